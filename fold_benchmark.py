@@ -0,0 +1,170 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This script measures how the parsing, pruning and dot plot stages scale with
+# sequence length and number of structures on synthetic trace files, and writes
+# time, throughput and peak memory per stage to a CSV report
+# --------------------------------------------------------------------------------
+
+# Folder for the synthetic trace files and the report. Trace files are only generated if they don't exist yet
+bench_dir = '/Users/chstei/Postdoc/benchmark'
+
+# Sequence lengths and numbers of structures, every combination is measured
+# Default: [50, 200, 1000] and [1000, 10000, 100000]
+nt_lengths = [50, 200, 1000]
+structure_counts = [1000, 10000, 100000]
+# Share of base pair breathing variants and of structures with single-bp-bridges in the synthetic traces
+# Default: 0.3 and 0.1
+breathing_rate = 0.3
+bridge_rate = 0.1
+# Breathing detection methods to compare, see fold_prune. The all-against-all 'pairwise' method is only run up to
+# pairwise_limit structures
+# Default: ['index', 'numpy', 'pairwise'] and 2000
+breathing_methods = ['index', 'numpy', 'pairwise']
+pairwise_limit = 2000
+# Structures used for the dot plot accumulation, as retain_folds in fold_dotplot
+# Default: 1000
+retain_folds = 1000
+# Repeat every measurement with tracemalloc for the peak memory of each stage? This doubles the runtime
+# Default: True
+measure_memory = True
+# Measure the import time of the scripts as well? fold_prune is the import a prune-only run pays for
+# Default: ['fold_prune', 'fold_dotplot', 'mcfold_fetch_images', 'mcff_submit'], [] to skip
+import_modules = ['fold_prune', 'fold_dotplot', 'mcfold_fetch_images', 'mcff_submit']
+# Report file name in bench_dir
+# Default: 'benchmark.csv'
+report_name = 'benchmark.csv'
+
+# -------
+# Imports
+# -------
+from fold_cli import apply_settings
+import fold_frequency
+import fold_prune
+from fold_profile import StageProfiler
+from fold_synthetic import write_trace
+import numpy as np
+import os
+import subprocess
+import sys
+import tracemalloc
+
+
+# -------
+# Classes
+# -------
+class MemoryStage:
+    # Context manager with the same use as StageProfiler.stage, recording the peak memory in MB
+    def __init__(self, name, peaks):
+        self.name = name
+        self.peaks = peaks
+
+    def __enter__(self):
+        tracemalloc.reset_peak()
+        self.start = tracemalloc.get_traced_memory()[0]
+
+    def __exit__(self, *exc_info):
+        self.peaks[self.name] = (tracemalloc.get_traced_memory()[1] - self.start) / 1024**2
+
+
+# ---------
+# Functions
+# ---------
+def import_time(module):
+    # Cumulative import time in s of a module in a fresh interpreter, as reported by python -X importtime
+    report = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], stderr=subprocess.PIPE,
+                            text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stderr
+    for line in report.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1e6
+    return None
+
+
+def run_stages(trace_name, profile, peaks=None):
+    # Runs the stages of fold_prune and the dot plot accumulation on one trace file. With peaks, the peak traced memory
+    # of each stage is recorded in it instead of timing the stages
+    def measured(name):
+        if peaks is None:
+            return profile.stage(name)
+        return MemoryStage(name, peaks)
+
+    trace_file = fold_prune.TraceFile(bench_dir, trace_name)
+    with measured('parse'):
+        trace_file.parse_input()
+    with measured('table'):
+        trace_file.make_bp_table()
+    with measured('single'):
+        trace_file.remove_single_bp_bridges()
+    for method in breathing_methods:
+        if method == 'pairwise' and len(trace_file.keep) > pairwise_limit:
+            continue
+        trace_file.breathing_list = []  # Every method starts from the same structures
+        with measured('breathing_' + method):
+            if method == 'pairwise':
+                trace_file.var_remove_bp_breathing()
+            elif method == 'numpy':
+                trace_file.numpy_remove_bp_breathing()
+            else:
+                trace_file.index_remove_bp_breathing()
+    with measured('discard'):
+        trace_file.discard_structures()
+    pair_tables = trace_file.bp_table[trace_file.keep][:retain_folds]
+    size = trace_file.bp_table.shape[1]
+    with measured('dotplot'):
+        fold_frequency.frequency_matrix(pair_tables, size)
+        fold_frequency.unpaired_counts(pair_tables, size)
+    with measured('dotplot_sparse'):
+        fold_frequency.sparse_frequencies([pair_tables], size)
+    return trace_file
+
+
+def main(argv=None):
+    apply_settings(globals(), 'Benchmark the parsing, pruning and dot plot stages on synthetic trace files', argv)
+    if not os.path.isdir(bench_dir):
+        print('# ----------------------------------------------------' + '-' * len(bench_dir))
+        print(f'# Please create the folder {bench_dir} before running this script')
+        print('# ----------------------------------------------------' + '-' * len(bench_dir))
+        sys.exit()
+    fold_prune.use_cache = False    # Always measure the parsing of the text
+    fold_prune.verbosity = 0
+
+    with open(bench_dir + '/' + report_name, 'w') as report_file:
+        report_file.write('nt_length,structures,stage,wall_s,cpu_s,structures_per_s,peak_mb\n')
+        for module in import_modules:
+            measured = [import_time(module) for _ in range(3)]
+            if None in measured:
+                print(f'Import {module}: not found in the -X importtime report')
+                continue
+            seconds = min(measured)     # Best of three against disk cache effects
+            report_file.write(f',,import_{module},{round(seconds, 6)},,,\n')
+            print(f'Import {module}: {round(seconds * 1000, 1)} ms')
+        for nt_length in nt_lengths:
+            for structure_count in structure_counts:
+                trace_name = f'synthetic_{nt_length}nt_{structure_count}_complete.out.txt'
+                if not os.path.isfile(bench_dir + '/' + trace_name):
+                    write_trace(bench_dir + '/' + trace_name, nt_length, structure_count, breathing_rate, bridge_rate)
+                profile = StageProfiler(bench_dir, trace_name)
+                peaks = {}
+                trace_file = run_stages(trace_name, profile)
+                if measure_memory:
+                    tracemalloc.start()
+                    run_stages(trace_name, profile, peaks)
+                    tracemalloc.stop()
+                print(f'{nt_length} nt, {structure_count} structures, '
+                      f'{int(np.count_nonzero(trace_file.keep))} after pruning:')
+                # The dot plot stages only accumulate the top retain_folds surviving structures
+                dotplot_count = min(retain_folds, int(np.count_nonzero(trace_file.keep)))
+                for name, current_stage in profile.stages.items():
+                    count = dotplot_count if name.startswith('dotplot') else structure_count
+                    rate = count / current_stage['wall'] if current_stage['wall'] > 0 else float('inf')
+                    peak = round(peaks[name], 3) if name in peaks else ''
+                    report_file.write(f'{nt_length},{structure_count},{name},{round(current_stage["wall"], 6)},'
+                                      f'{round(current_stage["cpu"], 6)},{round(rate, 1)},{peak}\n')
+                    print(f'  {name.capitalize()}: {round(current_stage["wall"], 3)} s, {int(rate)} structures/s'
+                          + (f', {peak} MB peak' if peak != '' else ''))
+
+
+if __name__ == '__main__':
+    main()
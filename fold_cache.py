@@ -0,0 +1,112 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This module keeps parsed trace files from mc-fold 2.32 or mcff in a binary
+# <trace file>_cache folder next to the trace file, so that fold_prune and
+# fold_dotplot don't have to parse the text again. Each
+# column is stored as a memory-mappable .npy file. The cache belongs to the size
+# and modification time of the trace file, like the fold_index sidecar. If they
+# changed, the content hash decides, so a touched or copied trace file keeps its
+# cache, and the cache is only ignored and replaced once the content changes
+# --------------------------------------------------------------------------------
+
+# -------
+# Imports
+# -------
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+
+# Columns with the text content of the trace file, row n holds the structure with the 1-indexed number n + 1
+text_columns = ('dotbrackets', 'energy_labels', 'energies')
+
+
+# -------
+# Classes
+# -------
+class TraceCache:
+    def __init__(self, trace_path):
+        self.trace_path = trace_path
+        self.cache_dir = trace_path + '_cache'
+        self.meta_path = self.cache_dir + '/meta.json'
+        self.trace_hash = None
+
+    def content_hash(self):
+        if self.trace_hash is None:
+            digest = hashlib.sha256()
+            with open(self.trace_path, 'rb') as trace_file:
+                for block in iter(lambda: trace_file.read(1 << 20), b''):
+                    digest.update(block)
+            self.trace_hash = digest.hexdigest()
+        return self.trace_hash
+
+    def stamp(self):
+        trace_stat = os.stat(self.trace_path)
+        return [trace_stat.st_size, trace_stat.st_mtime_ns]
+
+    def read_meta(self):
+        # A matching stamp is enough, only a cache with a different stamp costs a full read of the trace file
+        try:
+            with open(self.meta_path, 'r') as meta_file:
+                meta = json.load(meta_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if meta.get('stamp') == self.stamp():
+            return meta
+        if meta.get('hash') != self.content_hash():
+            return None
+        meta['stamp'] = self.stamp()    # Same content, so later loads take the fast path again
+        self.write_meta(meta)
+        return meta
+
+    def write_meta(self, meta):
+        temp_path = f'{self.meta_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp_path, self.meta_path)
+
+    def load(self, *names):
+        # Returns a dict of read-only memory-mapped arrays, or None if the cache is missing, stale or incomplete
+        meta = self.read_meta()
+        if meta is None or not all(name in meta['columns'] for name in names):
+            return None
+        try:
+            return {name: np.load(self.cache_dir + '/' + name + '.npy', mmap_mode='r') for name in names}
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, **columns):
+        # Adds columns to a cache that is still valid, a stale cache is replaced. Every file is written under a
+        # temporary name first, so concurrent readers never see half-written columns
+        meta = self.read_meta()
+        if meta is None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            meta = {'hash': self.content_hash(), 'stamp': self.stamp(), 'columns': []}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name, column in columns.items():
+            temp_path = f'{self.cache_dir}/{name}.{os.getpid()}.tmp.npy'
+            np.save(temp_path, np.ascontiguousarray(column))
+            os.replace(temp_path, self.cache_dir + '/' + name + '.npy')
+            if name not in meta['columns']:
+                meta['columns'].append(name)
+        self.write_meta(meta)
+
+
+# ---------
+# Functions
+# ---------
+def read_trace(trace_path):
+    with open(trace_path, 'rb') as trace_file:
+        return parse_trace(trace_file)
+
+
+def parse_trace(lines):
+    # Each line holds a dot-bracket structure and its energy, separated by a space. Blank lines are skipped
+    items = [line.split(b' ') for line in lines if line.strip()]
+    energy_labels = np.array([item[1].rstrip() for item in items], dtype=bytes)   # Energies exactly as written by mcff
+    return {'dotbrackets': np.array([item[0] for item in items], dtype=bytes),
+            'energy_labels': energy_labels,
+            'energies': energy_labels.astype(np.float64)}
@@ -0,0 +1,65 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This module lets every script take its settings from the command line as well
+# as from the globals at its top, e.g.
+# python fold_prune.py --set workers=4 --set "file_names=['h23_complete.out.txt']"
+# --------------------------------------------------------------------------------
+
+# -------
+# Imports
+# -------
+import argparse
+import ast
+import importlib
+import types
+
+
+# ---------
+# Functions
+# ---------
+def apply_settings(settings, description, argv=None):
+    # Overrides the settings in the globals() dict of a script with NAME=VALUE arguments. Values are read as Python
+    # literals (numbers, lists, None, True/False, quoted strings) and otherwise taken as plain strings. Settings whose
+    # default is derived from another one, e.g. title_figure from file_name, default to None and are resolved by the
+    # main() of the script after the overrides
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a setting from the top of the script, can be given several times')
+    arguments = parser.parse_args(argv)
+    for setting in arguments.set:
+        name, separator, value = setting.partition('=')
+        if not separator or name.startswith('_') or name not in settings \
+                or isinstance(settings[name], (types.ModuleType, types.FunctionType, type)):
+            parser.error(f'unknown setting {name}, use one of the settings at the top of the script')
+        try:
+            settings[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            settings[name] = value
+    return settings
+
+
+def is_plain(value):
+    # Settings are plain data: numbers, strings, None and lists, tuples or dicts of them
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return True
+    if isinstance(value, (list, tuple)):
+        return all(is_plain(item) for item in value)
+    if isinstance(value, dict):
+        return all(is_plain(key) and is_plain(item) for key, item in value.items())
+    return False
+
+
+def settings_snapshot(*settings_dicts):
+    # Picklable copy of the current settings in the globals() dicts of scripts, by module name, for restore_settings
+    return {settings['__name__']: {name: value for name, value in settings.items()
+                                   if not name.startswith('_') and is_plain(value)}
+            for settings in settings_dicts}
+
+
+def restore_settings(snapshot):
+    # Initializer for process pools. With the spawn start method (the default on macOS) every worker imports the
+    # scripts afresh and would get the defaults back instead of the --set overrides or settings changed by the caller
+    for module_name, settings in snapshot.items():
+        vars(importlib.import_module(module_name)).update(settings)
@@ -0,0 +1,143 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This module groups energy-ordered structures into clusters of structures that
+# differ by at most k base pairs from a lower-energy representative. The base pair
+# distance is the number of base pairs found in only one of two structures. The
+# representatives are kept in a metric index, so a structure is only compared to
+# the representatives that can possibly be within k
+# --------------------------------------------------------------------------------
+
+# -------
+# Imports
+# -------
+import heapq
+import numpy as np
+
+
+# -------
+# Classes
+# -------
+class BKTree:
+    # Every node is [pair set, index, {distance to the node: child}]. All structures below the child at distance d
+    # have distance d to the node, so by the triangle inequality only children within d - k to d + k can hold a match
+    def __init__(self):
+        self.root = None
+        self.size = 0
+        self.comparisons = 0
+
+    def add(self, pairs, index):
+        node = [pairs, index, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = len(current[0] ^ pairs)
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def first_within(self, pairs, k):
+        # (index, distance) of the representative with the lowest index within distance k, or None
+        best = None
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = len(node[0] ^ pairs)
+            self.comparisons += 1
+            if distance <= k and (best is None or node[1] < best[0]):
+                best = (node[1], distance)
+            for child_distance, child in node[2].items():
+                if distance - k <= child_distance <= distance + k:
+                    pending.append(child)
+        return best
+
+
+class PairSketch:
+    # The base pairs are split into k + 1 buckets by a hash of each pair. Two structures within distance k differ in at
+    # most k buckets, so they have at least one bucket with exactly the same pairs. Representatives are indexed by the
+    # content of each of their non-empty buckets and only those sharing a bucket are compared, lowest index first.
+    # Empty buckets are left out, as all sparse structures would share them. Two structures within k that only share
+    # empty buckets have pairs in at most k buckets each. Such sparse structures are matched through their pairs
+    # instead: within k they either share a base pair, or they share none and have at most k pairs together
+    def __init__(self, k):
+        self.k = k
+        self.buckets = {}       # (bucket, pairs in the bucket) -> indices of the representatives in ascending order
+        self.sparse_pairs = {}  # Pair -> indices of the sparse representatives containing it in ascending order
+        self.first_by_size = {}     # Number of pairs up to k -> index of the first representative with that many
+        self.pairs = {}         # Index -> pair set
+        self.size = 0
+        self.comparisons = 0
+
+    def sketch(self, pairs):
+        parts = [[] for _ in range(self.k + 1)]
+        for pair in pairs:
+            parts[(pair * 2654435761 >> 7) % (self.k + 1)].append(pair)
+        return [(bucket, frozenset(part)) for bucket, part in enumerate(parts) if part]
+
+    def add(self, pairs, index):
+        self.size += 1
+        self.pairs[index] = pairs
+        sketch = self.sketch(pairs)
+        for key in sketch:
+            self.buckets.setdefault(key, []).append(index)
+        if len(sketch) <= self.k:
+            for pair in pairs:
+                self.sparse_pairs.setdefault(pair, []).append(index)
+        if len(pairs) <= self.k:
+            self.first_by_size.setdefault(len(pairs), index)
+
+    def first_within(self, pairs, k):
+        # k has to be the k of the sketch, it only guarantees matches up to that distance
+        sketch = self.sketch(pairs)
+        candidates = [self.buckets[key] for key in sketch if key in self.buckets]
+        if len(sketch) <= self.k:
+            candidates.extend(self.sparse_pairs[pair] for pair in pairs if pair in self.sparse_pairs)
+            small = [index for size, index in self.first_by_size.items() if size + len(pairs) <= k]
+            if small:
+                candidates.append([min(small)])
+        previous = None
+        for index in heapq.merge(*candidates):
+            if index == previous:
+                continue
+            previous = index
+            self.comparisons += 1
+            distance = len(self.pairs[index] ^ pairs)
+            if distance <= k:
+                return index, distance
+        return None
+
+
+# ---------
+# Functions
+# ---------
+def pair_sets(pair_tables):
+    # Base pairs of each structure as a frozenset of nt * size + partner codes, every pair is counted once
+    pair_tables = np.asarray(pair_tables)
+    size = pair_tables.shape[1] + 1
+    rows, nts = np.nonzero(pair_tables > np.arange(1, size))
+    cells = ((nts + 1) * size + pair_tables[rows, nts]).tolist()
+    bounds = np.searchsorted(rows, np.arange(len(pair_tables) + 1)).tolist()
+    return [frozenset(cells[start:stop]) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def cluster_structures(pair_tables, k, method='sketch'):
+    # Greedy clustering in energy order: a structure joins the lowest-energy representative within k base pairs or
+    # becomes a representative itself. method is 'sketch' or 'bktree', both give the same clusters. Returns the row of
+    # the representative and the distance for every row, and the index of the representatives
+    representatives = np.empty(len(pair_tables), dtype=np.int64)
+    distances = np.zeros(len(pair_tables), dtype=np.int64)
+    metric_index = PairSketch(k) if method == 'sketch' else BKTree()
+    for row, pairs in enumerate(pair_sets(pair_tables)):
+        match = metric_index.first_within(pairs, k)
+        if match is None:
+            metric_index.add(pairs, row)
+            representatives[row] = row
+        else:
+            representatives[row], distances[row] = match
+    return representatives, distances, metric_index
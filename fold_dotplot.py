@@ -10,11 +10,24 @@ file_name = 'h23-top_pruned.out.txt'
 
 nt_seq = 'GGUGUAGCGGUGAAAUGCGUAGAGACC'
 retain_folds = 1000
+# Keep all structures up to this many kcal/mol above the lowest energy instead, overrides retain_folds if set
+# Default: None
+retain_energy = None
 from_nt1 = 3
 to_nt1 = 13
 from_nt2 = 14
 to_nt2 = 25
 
+# Load the structures from the binary cache next to the trace file, including the bp tables if fold_prune wrote them?
+# Without the bp tables only the retained structures are read from the text, through the <trace file>_index sidecar
+# Default: True
+use_cache = True
+
+# Numbers of retained structures for a convergence series of the dot plot, all computed from the same cumulative counts.
+# The changes of the paired frequencies relative to the largest cutoff are written to <file_name>_convergence.csv
+# Default: [] (off), e.g. [10, 100, 1000, 10000]
+convergence_folds = []
+
 plot_limits = ['dot', 'bulge'] # TODO implement switching graphical limits on/off separately
 
 # Show figure?
@@ -24,209 +37,379 @@ show_figure = True # TODO make this separate for all three plots
 # Default: True
 save_figure = True
 # Title for figure
-# Default: file_name
-title_figure = file_name
-# File extension for figure
+# Default: None for file_name
+title_figure = None
+# File extension for figure, each plot is saved as <file_name>_<dot|bulge1|bulge2|energy>.<ext>
 # Default: 'pdf', supports export to multiple formats at the same time with e.g. ['pdf', 'png']
 ext_figure = ['pdf']
 
+# Plot long sequences such as full-length rRNAs in the large-sequence mode? Base pairing frequencies are then kept in a
+# sparse matrix, only the upper triangle is rasterized and the axis labels are thinned out. True, False or 'auto' for
+# sequences longer than 500 nt
+# Default: 'auto'
+large_sequence = 'auto'
+# Maximum number of nucleotide or structure labels per axis in the large-sequence mode
+# Default: 50
+max_labels = 50
+
+# Batch rendering: equal-length lists of directories, file names and sequences. If set, these files are rendered
+# headless in worker processes and saved instead of the single file above, using the same settings otherwise
+# Default: [] (off)
+batch_dir_names = []
+batch_file_names = []
+batch_nt_seqs = []
+# Number of worker processes for batch rendering
+# Default: 4
+batch_workers = 4
+
 # -------
 # Imports
 # -------
-import forgi.graph.bulge_graph as fgb
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-from matplotlib.colors import Normalize
+from concurrent.futures import ProcessPoolExecutor
+from fold_cache import text_columns, TraceCache
+from fold_cli import apply_settings, restore_settings, settings_snapshot
+from fold_frequency import FrequencyIndex, folds_within, sparse_convergence
+from fold_index import open_index
+from fold_parse import dotbracket_to_pair_table
 import numpy as np
-from mpl_toolkits.axes_grid1 import make_axes_locatable
+import sys
+# matplotlib and scipy are only imported by the functions that need them, so compute_plot_data can be used without
+# paying for the plotting import chain
+
+plot_names = ['dot', 'bulge1', 'bulge2', 'energy']
+chunk_folds = 1000      # Structures per chunk in the large-sequence mode, this bounds the memory for the accumulation
+worker_figures = []     # Figures of a batch worker process, reused for every file it renders
 
 
 # ---------
 # Functions
 # ---------
-def layer_setup(x_scale=1.0, y_scale=1.0):
-    figure, layer = plt.subplots()
-    layer.set_title(title_figure + '\n' + str(len(cut_list)) + ' out of ' + str(len(raw_list)) + ' structures',
-                    loc='center')
-    figure.set_size_inches(figure.get_size_inches()[0] * x_scale,
-                           figure.get_size_inches()[0] * y_scale)  # Scale up from default size
-    return figure, layer
+def layer_setup(figure, title, plot_data, x_scale=1.0, y_scale=1.0):
+    import matplotlib
+    figure.clf()    # Figures are reused, so start from a clean canvas
+    layer = figure.add_subplot()
+    layer.set_title(title + '\n' + str(plot_data['cut_folds']) + ' out of ' + str(plot_data['total_folds'])
+                    + ' structures', loc='center')
+    figure.set_size_inches(matplotlib.rcParams['figure.figsize'][0] * x_scale,
+                           matplotlib.rcParams['figure.figsize'][0] * y_scale)  # Scale up from default size
+    return layer
 
 
-def make_figure():
+def make_figure(figure, current_dir_name, current_file_name, plot_name):
     if save_figure:
         for ext in ext_figure:
-            plt.savefig(dir_name + '/' + file_name + '_dot.' + ext, bbox_inches='tight')
-    if show_figure:
-        plt.show()
-
-
-#nt_nt = [nt for nt in nt_seq]   # Get individual nucleotides from sequence
-nt_nt = [nt+str(i+1) for i, nt in enumerate(nt_seq)]   # Get individual nucleotides from sequence
-
-dotbracket_data = dir_name+'/'+file_name
-with open(dotbracket_data, 'r') as dotbracket_file:
-    raw_list = [line.split(' ')[:2] for line in dotbracket_file]
-cut_list = raw_list[:retain_folds]  # Remove the n folds with the highest energy
-
-bp_freq = np.zeros([len(nt_seq), len(nt_seq)])
-bp_hidden = np.ones([len(nt_seq), len(nt_seq)])         # Create alpha value matrix for bp limits
-bp_background = np.zeros([len(nt_seq), len(nt_seq)])    # Create uniformly colored background for alpha channel
-bulge_freq = []
-energy_list = []
-for line in range(len(cut_list)):
-    bg = fgb.BulgeGraph.from_dotbracket(cut_list[line][0])
-    bp = bg.to_pair_table()
-    for nt, partner in enumerate(bp[1:]):
-        if partner == 0:
-            bulge_freq.append(nt)
-    for nt, partner in enumerate(bp[1:(1+bp[0]) // 2]): # TODO Try to query the bg function for loops instead, or the partner > nt + 1 test
-        if partner != 0:            # ignore unpaired nucleotides now, these could otherwise show up at the edges depending on the image drawing method
-            if line == 0:           # Lowest-energy structure
-                bp_freq[partner - 1, nt] = len(cut_list)
-            if partner > nt + 1:    # ignore duplicates from going over the halfway point of the sequence
-                bp_freq[nt, partner - 1] += 1
-    energy_list.append(float(cut_list[line][1]))
-    energy_array = np.array(energy_list)
-bp_freq /= len(cut_list)            # Normalize to [0,1] base pairing probability range
-
-for nt in range(len(nt_seq)):
-    if nt in range(from_nt1 - 1) or nt in range(to_nt1, from_nt2 - 1) or nt in range(to_nt2, len(nt_seq)):
-        bp_hidden[nt, :] = 0.25
-        bp_hidden[:, nt] = 0.25
-        bp_background[nt, :] = 0.25
-        bp_background[:, nt] = 0.25
-
-# --------------------------
-# Set up layers for dot plot
-# --------------------------
-figure1, layer1 = layer_setup(x_scale=1.5, y_scale=1.5)
-
-# -----------------
-# Generate dot plot
-# -----------------
-#dotplot = layer.pcolormesh(np.ma.masked_where(bp_freq == 0, bp_freq), vmin=0.001, vmax=np.max(bp_freq))
-background = layer1.imshow(bp_background, vmin=0, vmax=1, cmap='Greys')
-dotplot = layer1.imshow(np.ma.masked_where(bp_freq == 0, bp_freq), vmin=0.001, vmax=np.max(bp_freq))
-layer1.tick_params(which='major', top=True, labeltop=True, right=True, labelright=True)     # Dual x and y axes
-layer1.tick_params(axis='x', labelrotation=45)
-# layer.set(xlabel='5\'–3\'',
-#           xticks=(np.arange(len(nt_seq)) + 0.5),    # Shift major ticks to the center of each cell
-#           xticklabels=(nt_nt),
-#           yticks=(np.arange(len(nt_seq)) + 0.5),
-#           yticklabels=(nt_nt),
-#           aspect='equal')
-# layer.invert_yaxis()
-layer1.set(xlabel='5\'–3\'',
-           xticks=range(len(nt_seq)),  # Shift major ticks to the center of each cell
-           xticklabels=nt_nt,
-           #xlim=(from_nt1-1.5, to_nt1-0.5),  # Subtract 1 because of indexing and 0.5 because of centered ticks
-           yticks=range(len(nt_seq)),
-           yticklabels=nt_nt)#,
-            # #ylim=(to_nt2-0.5, from_nt2-1.5))
-
-# --------------
-# Add grid lines
-# --------------
-# layer.set_xticks(np.arange(len(nt_seq)), minor=True)   # Add minor ticks for grid generation
-# layer.set_yticks(np.arange(len(nt_seq)), minor=True)
-
-layer1.set_xticks(np.arange(len(nt_seq))-0.5, minor=True)
-#layer.set_xlim(from_nt1-1.5, to_nt1-0.5)
-layer1.set_yticks(np.arange(len(nt_seq))-0.5, minor=True)
-#layer.set_ylim(to_nt2-0.5, from_nt2-1.5)
-layer1.tick_params(which='minor', length=0)              # Don't show the actual minor ticks
-layer1.grid(which='minor', color='k', linewidth=0.5)
-layer1.plot([np.arange(len(nt_seq))-0.5, np.arange(len(nt_seq))+0.5], [np.arange(len(nt_seq))-0.5, np.arange(len(nt_seq))+0.5], color='k', linewidth=0.5)    # Add diagonal
-
-# ----------------
-# Adjust color bar
-# ----------------
-divider = make_axes_locatable(layer1)
-legend = divider.append_axes('right', size=figure1.get_size_inches()[0]*0.025, pad=figure1.get_size_inches()[0]*0.05)
-figure1.colorbar(cm.ScalarMappable(norm=Normalize(vmin=0.001, vmax=1)), label='Paired frequency', ticks=np.linspace(0, 1, 5), cax=legend)
-
-# ---------------
-# Generate figure
-# ---------------
-make_figure()
-    
-# ---------------------------------
-# Set up layers for bulge histogram
-# ---------------------------------
-figure2, layer2 = layer_setup(x_scale=1.5, y_scale=0.5)
-
-# ------------------------
-# Generate bulge histogram
-# ------------------------
-layer2.hist(bulge_freq, bins=range((len(nt_seq))))    # Explicit bin creating to ensure centering of the histogram bars
-layer2.set_xlabel('5\'–3\'')
-layer2.set_xticks(np.arange(len(nt_seq)) + 0.5)   # Shift major ticks to the center of each cell
-layer2.set_xticklabels(nt_nt)
-layer2.set_ylim(0, len(cut_list))
-layer2.set_ylabel('Unpaired frequency')
-layer2.set_yticks(np.linspace(0, len(cut_list), 5))
-layer2.set_yticklabels(np.linspace(0, 1, 5))
-
-# --------------
-# Add grid lines
-# --------------
-layer2.set_xticks(np.arange(len(nt_seq)), minor=True)
-layer2.grid(which='minor', color='k', linewidth=0.5)
-layer2.tick_params(which='minor', length=1)
-layer2.set_xlim(from_nt1-1, to_nt1)
-
-# ---------------
-# Generate figure
-# ---------------
-make_figure()
-
-# -------------------------------------
-# Set up layers for 2nd bulge histogram
-# -------------------------------------
-figure3, layer3 = layer_setup(x_scale=1.5, y_scale=0.5)
-
-# ----------------------------
-# Generate 2nd bulge histogram
-# ----------------------------
-layer3.hist(bulge_freq, bins=range((len(nt_seq))))    # Explicit bin creating to ensure centering of the histogram bars
-layer3.set_xlabel('5\'–3\'')
-layer3.set_xticks(np.arange(len(nt_seq)) + 0.5)   # Shift major ticks to the center of each cell
-layer3.set_xticklabels(nt_nt)
-layer3.set_ylim(0, len(cut_list))
-layer3.set_ylabel('Unpaired frequency')
-layer3.set_yticks(np.linspace(0, len(cut_list), 5))
-layer3.set_yticklabels(np.linspace(0, 1, 5))
-
-# --------------
-# Add grid lines
-# --------------
-layer3.set_xticks(np.arange(len(nt_seq)), minor=True)
-layer3.grid(which='minor', color='k', linewidth=0.5)
-layer3.tick_params(which='minor', length=1)
-layer3.set_xlim(from_nt2-1, to_nt2)
-
-# ---------------
-# Generate figure
-# ---------------
-make_figure()
-
-# --------------------------------
-# Set up layers for energy diagram
-# --------------------------------
-figure4, layer4 = layer_setup(x_scale=1.5, y_scale=0.5)
-
-# -----------------------
-# Generate energy diagram
-# -----------------------
-layer4.bar(range(1, np.size(energy_array) + 1), energy_array-energy_array.min())
-layer4.set_xlim(0.5, np.size(energy_array) + 0.5)
-layer4.set_xlabel('Structure')
-layer4.set_xticks(range(1, np.size(energy_array) + 1))
-layer4.set_xticklabels(range(1, np.size(energy_array) + 1))
-layer4.set_ylabel(r'$\Delta$$G$ (kcal mol$^{-1}$)')     # matplotlib works best with raw strings, $$ takes care of the proper minus sign without using \u2212
-
-# ---------------
-# Generate figure
-# ---------------
-make_figure()
+            figure.savefig(current_dir_name + '/' + current_file_name + '_' + plot_name + '.' + ext,
+                           bbox_inches='tight')
+
+
+def convergence_cutoffs(total_folds):
+    # Cutoffs of the convergence series in ascending order, cutoffs above the number of structures are clipped to it
+    cutoffs = sorted(folds for folds in {min(cutoff, total_folds) for cutoff in convergence_folds} if folds > 0)
+    if convergence_folds and not cutoffs:
+        raise ValueError(f'None of convergence_folds {convergence_folds} selects any of the {total_folds} structures')
+    return cutoffs
+
+
+def write_convergence(series, energies, current_dir_name, current_file_name, size):
+    # Paired frequencies of every (folds, frequency matrix, unpaired counts) in series compared to the last one, upper
+    # triangle only. The frequency matrices are dense arrays or, in the large-sequence mode, scipy sparse matrices
+    final_freq = series[-1][1]
+    dense = isinstance(final_freq, np.ndarray)
+    upper = np.triu_indices(size, k=1) if dense else None
+    with open(current_dir_name + '/' + current_file_name + '_convergence.csv', 'w') as convergence_file:
+        convergence_file.write('folds,delta_energy,max_change,mean_change\n')
+        for folds, current_freq, _ in series:
+            if dense:
+                change = np.abs(current_freq[upper] - final_freq[upper])
+                max_change, mean_change = change.max(), change.mean()
+            else:
+                from scipy import sparse
+                change = abs(sparse.triu(current_freq - final_freq, k=1))
+                max_change, mean_change = change.max(), change.sum() / (size * (size - 1) // 2)
+            convergence_file.write(f'{folds},{round(energies[folds - 1] - energies[0], 4)},'
+                                   f'{round(max_change, 6)},{round(mean_change, 6)}\n')
+
+
+def is_large(current_nt_seq):
+    return large_sequence is True or (large_sequence == 'auto' and len(current_nt_seq) > 500)
+
+
+def hidden_ranges(size):
+    # 0-indexed [start, stop) ranges of the nucleotides outside of the regions from_nt1-to_nt1 and from_nt2-to_nt2
+    return [(0, from_nt1 - 1), (to_nt1, from_nt2 - 1), (to_nt2, size)]
+
+
+def label_step(count):
+    # Distance between labels so that at most max_labels are shown, rounded to 1, 2 or 5 times a power of ten
+    step = 1
+    while count / step > max_labels:
+        step = step * 5 // 2 if str(step).startswith('2') else step * 2
+    return step
+
+
+def pair_table_chunks(trace, folds):
+    # Pair tables of the top structures in chunks of chunk_folds, from the cache or parsed chunk by chunk
+    for start in range(0, folds, chunk_folds):
+        stop = min(start + chunk_folds, folds)
+        if 'bp_table' in trace:
+            yield trace['bp_table'][start:stop]
+        else:
+            yield np.array([dotbracket_to_pair_table(dotbracket.decode())
+                            for dotbracket in trace['dotbrackets'][start:stop]], dtype=np.int16)
+
+
+def compute_plot_data(current_dir_name, current_file_name, current_nt_seq):
+    trace_path = current_dir_name + '/' + current_file_name
+    trace = TraceCache(trace_path).load(*text_columns, 'bp_table') if use_cache else None
+    if trace is None:
+        trace_index = open_index(trace_path)
+        energies = trace_index.energies
+    else:
+        energies = trace['energies']
+    total_folds = len(energies)
+    cut_folds = retain_folds if retain_energy is None else folds_within(energies, retain_energy)
+    cut_folds = min(cut_folds, total_folds)   # Remove the n folds with the highest energy
+    cutoffs = convergence_cutoffs(total_folds)
+    index_folds = max([cut_folds] + cutoffs)  # All cutoffs are served from one index over the top structures
+    if trace is None:   # Seek to the retained structures instead of parsing the whole text
+        trace = trace_index.read_rows(0, index_folds)
+    size = len(current_nt_seq)
+    plot_data = {'total_folds': total_folds,
+                 'cut_folds': cut_folds,
+                 'energy_array': np.array(trace['energies'][:cut_folds])}
+
+    if is_large(current_nt_seq):
+        # Nothing of size nucleotides x nucleotides is allocated densely, the regions are drawn as ranges. The
+        # convergence series comes from the same pass over the chunks as the plotted cutoff
+        series = {folds: (current_freq, current_unpaired) for folds, current_freq, current_unpaired
+                  in sparse_convergence(pair_table_chunks(trace, index_folds), size, cutoffs + [cut_folds])}
+    else:
+        if 'bp_table' in trace:
+            pair_tables = np.asarray(trace['bp_table'][:index_folds])
+        else:
+            pair_tables = np.array([dotbracket_to_pair_table(dotbracket.decode())
+                                    for dotbracket in trace['dotbrackets'][:index_folds]], dtype=np.int16)
+        frequency_index = FrequencyIndex(pair_tables, trace['energies'], size)
+        # The plotted cutoff is part of the same sweep as the convergence series
+        series = {folds: (current_freq, current_unpaired)
+                  for folds, current_freq, current_unpaired in frequency_index.convergence(cutoffs + [cut_folds])}
+    if cutoffs:
+        write_convergence([(folds, *series[folds]) for folds in cutoffs], trace['energies'], current_dir_name,
+                          current_file_name, size)
+    plot_data['bp_freq'], plot_data['bulge_freq'] = series[cut_folds]
+    if is_large(current_nt_seq):
+        return plot_data
+
+    hidden = np.zeros(size, dtype=bool)
+    for start, stop in hidden_ranges(size):
+        hidden[start:stop] = True
+    bp_hidden = np.ones([size, size])         # Create alpha value matrix for bp limits
+    bp_background = np.zeros([size, size])    # Create uniformly colored background for alpha channel
+    bp_hidden[hidden, :] = 0.25
+    bp_hidden[:, hidden] = 0.25
+    bp_background[hidden, :] = 0.25
+    bp_background[:, hidden] = 0.25
+    plot_data['bp_hidden'] = bp_hidden
+    plot_data['bp_background'] = bp_background
+    return plot_data
+
+
+def draw_dot_plot(figure, layer, plot_data, nt_nt):
+    import matplotlib.cm as cm
+    from matplotlib.colors import Normalize
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+    # -----------------
+    # Generate dot plot
+    # -----------------
+    bp_freq = plot_data['bp_freq']
+    #dotplot = layer.pcolormesh(np.ma.masked_where(bp_freq == 0, bp_freq), vmin=0.001, vmax=np.max(bp_freq))
+    layer.imshow(plot_data['bp_background'], vmin=0, vmax=1, cmap='Greys')
+    layer.imshow(np.ma.masked_where(bp_freq == 0, bp_freq), vmin=0.001, vmax=np.max(bp_freq))
+    layer.tick_params(which='major', top=True, labeltop=True, right=True, labelright=True)     # Dual x and y axes
+    layer.tick_params(axis='x', labelrotation=45)
+    # layer.set(xlabel='5\'–3\'',
+    #           xticks=(np.arange(len(nt_seq)) + 0.5),    # Shift major ticks to the center of each cell
+    #           xticklabels=(nt_nt),
+    #           yticks=(np.arange(len(nt_seq)) + 0.5),
+    #           yticklabels=(nt_nt),
+    #           aspect='equal')
+    # layer.invert_yaxis()
+    layer.set(xlabel='5\'–3\'',
+              xticks=range(len(nt_nt)),  # Shift major ticks to the center of each cell
+              xticklabels=nt_nt,
+              #xlim=(from_nt1-1.5, to_nt1-0.5),  # Subtract 1 because of indexing and 0.5 because of centered ticks
+              yticks=range(len(nt_nt)),
+              yticklabels=nt_nt)#,
+               # #ylim=(to_nt2-0.5, from_nt2-1.5))
+
+    # --------------
+    # Add grid lines
+    # --------------
+    # layer.set_xticks(np.arange(len(nt_seq)), minor=True)   # Add minor ticks for grid generation
+    # layer.set_yticks(np.arange(len(nt_seq)), minor=True)
+
+    layer.set_xticks(np.arange(len(nt_nt))-0.5, minor=True)
+    #layer.set_xlim(from_nt1-1.5, to_nt1-0.5)
+    layer.set_yticks(np.arange(len(nt_nt))-0.5, minor=True)
+    #layer.set_ylim(to_nt2-0.5, from_nt2-1.5)
+    layer.tick_params(which='minor', length=0)              # Don't show the actual minor ticks
+    layer.grid(which='minor', color='k', linewidth=0.5)
+    layer.plot([np.arange(len(nt_nt))-0.5, np.arange(len(nt_nt))+0.5], [np.arange(len(nt_nt))-0.5, np.arange(len(nt_nt))+0.5], color='k', linewidth=0.5)    # Add diagonal
+
+    # ----------------
+    # Adjust color bar
+    # ----------------
+    divider = make_axes_locatable(layer)
+    legend = divider.append_axes('right', size=figure.get_size_inches()[0]*0.025, pad=figure.get_size_inches()[0]*0.05)
+    figure.colorbar(cm.ScalarMappable(norm=Normalize(vmin=0.001, vmax=1)), label='Paired frequency', ticks=np.linspace(0, 1, 5), cax=legend)
+
+
+def draw_dot_plot_large(figure, layer, plot_data, nt_nt):
+    import matplotlib.cm as cm
+    from matplotlib.colors import Normalize
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+    # -----------------------------------------
+    # Generate dot plot from the sparse matrix
+    # -----------------------------------------
+    size = len(nt_nt)
+    bp_freq = plot_data['bp_freq'].tocoo()
+    upper = bp_freq.col > bp_freq.row
+    for start, stop in hidden_ranges(size):     # Grey background outside of the regions, as in the dense dot plot
+        if stop > start:
+            layer.axhspan(start - 0.5, stop - 0.5, color=cm.Greys(0.25), linewidth=0, zorder=0)
+            layer.axvspan(start - 0.5, stop - 0.5, color=cm.Greys(0.25), linewidth=0, zorder=0)
+    cell_size = figure.get_size_inches()[0] * 0.7 * 72 / size   # Approximate width of one nucleotide in points
+    vmax = bp_freq.data.max() if bp_freq.nnz else 1
+    layer.scatter(bp_freq.col[upper], bp_freq.row[upper], c=bp_freq.data[upper], s=cell_size ** 2, marker='s',
+                  linewidths=0, vmin=0.001, vmax=vmax, rasterized=True)    # Only the upper triangle is rasterized
+    layer.scatter(bp_freq.col[~upper], bp_freq.row[~upper], c=bp_freq.data[~upper], s=cell_size ** 2, marker='s',
+                  linewidths=0, vmin=0.001, vmax=vmax)                     # Lowest-energy structure
+    layer.plot([-0.5, size - 0.5], [-0.5, size - 0.5], color='k', linewidth=0.5)    # Add diagonal
+    step = label_step(size)
+    layer.tick_params(which='major', top=True, labeltop=True, right=True, labelright=True)     # Dual x and y axes
+    layer.tick_params(axis='x', labelrotation=45)
+    layer.set(xlabel='5\'–3\'',
+              xticks=range(0, size, step),
+              xticklabels=nt_nt[::step],
+              yticks=range(0, size, step),
+              yticklabels=nt_nt[::step],
+              xlim=(-0.5, size - 0.5),
+              ylim=(size - 0.5, -0.5),
+              aspect='equal')
+
+    # ----------------
+    # Adjust color bar
+    # ----------------
+    divider = make_axes_locatable(layer)
+    legend = divider.append_axes('right', size=figure.get_size_inches()[0]*0.025, pad=figure.get_size_inches()[0]*0.05)
+    figure.colorbar(cm.ScalarMappable(norm=Normalize(vmin=0.001, vmax=1)), label='Paired frequency', ticks=np.linspace(0, 1, 5), cax=legend)
+
+
+def draw_bulge_histogram(layer, plot_data, nt_nt, from_nt, to_nt, step=1):
+    # ------------------------
+    # Generate bulge histogram
+    # ------------------------
+    layer.hist(range(len(nt_nt)), bins=range((len(nt_nt))), weights=plot_data['bulge_freq'],
+               histtype='bar' if step == 1 else 'stepfilled')    # Explicit bin creating to ensure centering of the histogram bars, one outline instead of thousands of bars for thinned out labels
+    layer.set_xlabel('5\'–3\'')
+    layer.set_xticks(np.arange(from_nt - 1, to_nt, step) + 0.5)   # Shift major ticks to the center of each cell
+    layer.set_xticklabels(nt_nt[from_nt - 1:to_nt:step], rotation=45 if step > 1 else None)
+    layer.set_ylim(0, plot_data['cut_folds'])
+    layer.set_ylabel('Unpaired frequency')
+    layer.set_yticks(np.linspace(0, plot_data['cut_folds'], 5))
+    layer.set_yticklabels(np.linspace(0, 1, 5))
+
+    # --------------
+    # Add grid lines
+    # --------------
+    if step == 1:   # A grid line for every nucleotide is only drawn without thinned out labels
+        layer.set_xticks(np.arange(len(nt_nt)), minor=True)
+        layer.grid(which='minor', color='k', linewidth=0.5)
+        layer.tick_params(which='minor', length=1)
+    layer.set_xlim(from_nt-1, to_nt)
+
+
+def draw_energy_diagram(layer, plot_data, step=1):
+    # -----------------------
+    # Generate energy diagram
+    # -----------------------
+    energy_array = plot_data['energy_array']
+    if step == 1:
+        layer.bar(range(1, np.size(energy_array) + 1), energy_array-energy_array.min())
+    else:   # One outline instead of thousands of bars
+        heights = energy_array-energy_array.min()
+        layer.fill_between(np.arange(np.size(energy_array) + 1) + 0.5, np.append(heights, heights[-1:]), step='post',
+                           linewidth=0)   # Same as stairs, which needs matplotlib 3.4
+    layer.set_xlim(0.5, np.size(energy_array) + 0.5)
+    layer.set_xlabel('Structure')
+    layer.set_xticks(range(1, np.size(energy_array) + 1, step))
+    layer.set_xticklabels(range(1, np.size(energy_array) + 1, step), rotation=45 if step > 1 else None)
+    layer.set_ylabel(r'$\Delta$$G$ (kcal mol$^{-1}$)')     # matplotlib works best with raw strings, $$ takes care of the proper minus sign without using \u2212
+
+
+def render_figures(figures, current_dir_name, current_file_name, current_nt_seq, title):
+    # Draws the dot plot, both bulge histograms and the energy diagram into the four given figures
+    #nt_nt = [nt for nt in nt_seq]   # Get individual nucleotides from sequence
+    nt_nt = [nt+str(i+1) for i, nt in enumerate(current_nt_seq)]   # Get individual nucleotides from sequence
+    plot_data = compute_plot_data(current_dir_name, current_file_name, current_nt_seq)
+
+    large = is_large(current_nt_seq)
+
+    layer = layer_setup(figures[0], title, plot_data, x_scale=1.5, y_scale=1.5)
+    if large:
+        draw_dot_plot_large(figures[0], layer, plot_data, nt_nt)
+    else:
+        draw_dot_plot(figures[0], layer, plot_data, nt_nt)
+    layer = layer_setup(figures[1], title, plot_data, x_scale=1.5, y_scale=0.5)
+    draw_bulge_histogram(layer, plot_data, nt_nt, from_nt1, to_nt1,
+                         label_step(to_nt1 - from_nt1 + 1) if large else 1)
+    layer = layer_setup(figures[2], title, plot_data, x_scale=1.5, y_scale=0.5)
+    draw_bulge_histogram(layer, plot_data, nt_nt, from_nt2, to_nt2,
+                         label_step(to_nt2 - from_nt2 + 1) if large else 1)
+    layer = layer_setup(figures[3], title, plot_data, x_scale=1.5, y_scale=0.5)
+    draw_energy_diagram(layer, plot_data, label_step(plot_data['cut_folds']) if large else 1)
+
+    for figure, plot_name in zip(figures, plot_names):
+        make_figure(figure, current_dir_name, current_file_name, plot_name)
+
+
+def render_batch_file(current_dir_name, current_file_name, current_nt_seq):
+    # Runs in a worker process on the Agg canvas without pyplot, the figures are created once per worker
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    if not worker_figures:
+        for _ in plot_names:
+            figure = Figure()
+            FigureCanvasAgg(figure)
+            worker_figures.append(figure)
+    render_figures(worker_figures, current_dir_name, current_file_name, current_nt_seq, current_file_name)
+    return current_file_name
+
+
+def main(argv=None):
+    apply_settings(globals(), 'Draw dot plots, unpaired histograms and energy diagrams of mcff trace files', argv)
+    if any(cutoff <= 0 for cutoff in convergence_folds):
+        print('# -------------------------------------------------------------------')
+        print('# Please use only positive numbers of structures in convergence_folds')
+        print('# -------------------------------------------------------------------')
+        sys.exit()
+    if batch_file_names:
+        if not len(batch_dir_names) == len(batch_file_names) == len(batch_nt_seqs):
+            print('# ---------------------------------------------------------------------------')
+            print('# Please provide individual directory names and sequences for each batch file')
+            print('# ---------------------------------------------------------------------------')
+            sys.exit()
+        with ProcessPoolExecutor(max_workers=batch_workers, initializer=restore_settings,
+                                 initargs=(settings_snapshot(globals()),)) as executor:
+            for rendered in executor.map(render_batch_file, batch_dir_names, batch_file_names, batch_nt_seqs):
+                print('Rendered ' + rendered)
+    else:
+        import matplotlib.pyplot as plt
+        render_figures([plt.figure() for _ in plot_names], dir_name, file_name, nt_seq,
+                       file_name if title_figure is None else title_figure)
+        if show_figure:
+            plt.show()
+
+
+if __name__ == '__main__':  # Batch worker processes import this module, only the main process draws
+    main()
@@ -0,0 +1,180 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This module computes base pairing frequencies and unpaired counts from the pair
+# tables of energy-ordered structures, for a single cutoff or for a whole series
+# of cutoffs from one cumulative index
+# --------------------------------------------------------------------------------
+
+# -------
+# Imports
+# -------
+import numpy as np
+
+
+# ---------
+# Functions
+# ---------
+def first_half(pair_tables):
+    # Number of nucleotides from the 5' end that are scanned for base pairs
+    return (1 + pair_tables.shape[1]) // 2 - 1  # TODO Try to query the bg function for loops instead, or the partner > nt + 1 test
+
+
+def pair_events(pair_tables, size):
+    # Row and flattened (nt, partner) cell of every base pair, counted once in the upper triangle by going over the
+    # first half of every structure only. Rows come out in ascending order
+    half = first_half(pair_tables)
+    partners = pair_tables[:, :half].astype(np.int64)
+    rows, nts = np.nonzero(partners > np.arange(half) + 1)  # ignore unpaired nucleotides and duplicates from going over the halfway point of the sequence
+    return rows, nts * size + partners[rows, nts] - 1
+
+
+def pair_counts(pair_tables, size):
+    _, cells = pair_events(pair_tables, size)
+    return np.bincount(cells, minlength=size * size).reshape(size, size).astype(float)
+
+
+def mark_lowest(counts, lowest_table, folds):
+    # The lowest-energy structure is marked with the number of structures in the lower triangle. This also overrides
+    # its own count for pairs within the first half
+    nts = np.flatnonzero(lowest_table[:first_half(lowest_table[np.newaxis])])
+    counts[lowest_table[nts].astype(np.int64) - 1, nts] = folds
+    return counts
+
+
+def frequency_matrix(pair_tables, size):
+    # Base pairing frequencies in the upper triangle, the lowest-energy structure is marked in the lower triangle
+    if len(pair_tables) == 0:
+        return np.zeros([size, size])
+    lowest = mark_lowest(pair_counts(pair_tables[:1], size), pair_tables[0], len(pair_tables))
+    return (lowest + pair_counts(pair_tables[1:], size)) / len(pair_tables)   # Normalize to [0,1] base pairing probability range
+
+
+def unpaired_counts(pair_tables, size):
+    # Number of structures in which each nucleotide is unpaired
+    counts = np.zeros(size)
+    counts[:pair_tables.shape[1]] = (pair_tables == 0).sum(axis=0)
+    return counts
+
+
+def sparse_frequencies(pair_table_chunks, size):
+    # Same numbers as frequency_matrix and unpaired_counts for long sequences, see sparse_convergence. Returns
+    # (frequency matrix as scipy.sparse.csr_matrix, unpaired counts, number of structures)
+    for folds, counts, unpaired in sparse_convergence(pair_table_chunks, size, []):
+        return counts, unpaired, folds
+
+
+def sparse_convergence(pair_table_chunks, size, cutoffs):
+    # Same series as FrequencyIndex.convergence for long sequences, accumulated chunk by chunk of structures into a
+    # sparse matrix, so memory depends on the chunk size and the number of distinct base pairs only. Yields (folds,
+    # frequency matrix as scipy.sparse.csr_matrix, unpaired counts) for each cutoff in ascending order. Cutoffs above
+    # the number of structures are clipped to it, without cutoffs only the result for all structures is yielded
+    from scipy import sparse   # Only the large-sequence mode pays for the scipy import
+    pending = sorted({max(cutoff, 0) for cutoff in cutoffs}, reverse=True)
+    counts = sparse.csr_matrix((size, size))
+    unpaired = np.zeros(size)
+    folds = 0
+    yielded = None
+    lowest_table = None
+    if pending and pending[-1] == 0:
+        yield 0, counts, unpaired.copy()
+        yielded = pending.pop()
+    for chunk in pair_table_chunks:
+        chunk = np.asarray(chunk)
+        while len(chunk):
+            part = chunk[:pending[-1] - folds] if pending else chunk   # Chunks are split up at the cutoffs
+            chunk = chunk[len(part):]
+            unpaired[:part.shape[1]] += (part == 0).sum(axis=0)
+            folds += len(part)
+            if lowest_table is None:
+                lowest_table = part[0].copy()
+                part = part[1:]
+            _, cells = pair_events(part, size)
+            counts = counts + sparse.csr_matrix((np.ones(len(cells)), (cells // size, cells % size)),
+                                                shape=(size, size))
+            if pending and folds == pending[-1]:
+                yield folds, sparse_marked(counts, lowest_table, folds, size), unpaired.copy()
+                yielded = pending.pop()
+    if (pending or not cutoffs) and folds != yielded:
+        yield folds, sparse_marked(counts, lowest_table, folds, size) if folds else counts, unpaired
+
+
+def sparse_marked(counts, lowest_table, folds, size):
+    # Counts the lowest-energy structure and marks it the same way as mark_lowest, the mark overrides its own count
+    from scipy import sparse
+    lowest = {(cell // size, cell % size): 1.0 for cell in pair_events(lowest_table[np.newaxis], size)[1].tolist()}
+    nts = np.flatnonzero(lowest_table[:first_half(lowest_table[np.newaxis])])
+    for nt, partner in zip(nts.tolist(), lowest_table[nts].tolist()):
+        lowest[(partner - 1, nt)] = float(folds)
+    lowest_rows, lowest_cols = zip(*lowest) if lowest else ((), ())
+    marked = counts + sparse.csr_matrix((list(lowest.values()), (lowest_rows, lowest_cols)), shape=(size, size))
+    marked.data /= folds    # Exact division like the dense path, scipy would multiply by the reciprocal instead
+    return marked
+
+
+def folds_within(energies, energy_window):
+    # Number of energy-ordered structures at most energy_window kcal/mol above the lowest energy
+    if len(energies) == 0:
+        return 0
+    return int(np.searchsorted(energies, energies[0] + energy_window, side='right'))
+
+
+# -------
+# Classes
+# -------
+class FrequencyIndex:
+    # Cumulative index over energy-ordered pair tables: the base pairs and unpaired nucleotides of all structures are
+    # kept as event lists sorted by structure, so the counts for the top n structures are a bincount over a prefix of
+    # the events. Memory is proportional to the number of events, not to structures x nucleotides x nucleotides
+    def __init__(self, pair_tables, energies, size):
+        pair_tables = np.asarray(pair_tables)
+        self.size = size
+        self.energies = np.asarray(energies[:len(pair_tables)], dtype=np.float64)
+        self.lowest_table = pair_tables[0].copy() if len(pair_tables) else None
+        self.pair_rows, self.pair_cells = pair_events(pair_tables, size)
+        self.unpaired_rows, self.unpaired_nts = np.nonzero(pair_tables == 0)
+
+    def __len__(self):
+        return len(self.energies)
+
+    def folds_within(self, energy_window):
+        return folds_within(self.energies, energy_window)
+
+    def pair_counts(self, start, stop):
+        # Upper triangle counts of structures start to stop - 1 (0-indexed)
+        first, last = np.searchsorted(self.pair_rows, [start, stop])
+        return np.bincount(self.pair_cells[first:last], minlength=self.size * self.size).reshape(self.size, self.size)
+
+    def unpaired_counts(self, folds):
+        last = np.searchsorted(self.unpaired_rows, min(folds, len(self)))
+        return np.bincount(self.unpaired_nts[:last], minlength=self.size).astype(float)
+
+    def frequency_matrix(self, folds):
+        # Same result as frequency_matrix on the top n pair tables
+        folds = min(folds, len(self))
+        if folds == 0:
+            return np.zeros([self.size, self.size])
+        lowest = mark_lowest(self.pair_counts(0, 1).astype(float), self.lowest_table, folds)
+        return (lowest + self.pair_counts(1, folds)) / folds
+
+    def convergence(self, cutoffs):
+        # Yields (folds, frequency matrix, unpaired counts) for each cutoff in ascending order. Only the events of the
+        # structures between one cutoff and the next are added to the running counts, so the whole series adds up
+        # every event once
+        running = np.zeros(self.size * self.size, dtype=np.int64)   # Pair counts of structures 2 to folds
+        unpaired = np.zeros(self.size, dtype=np.int64)
+        pair_first = np.searchsorted(self.pair_rows, 1)   # The lowest-energy structure is counted by mark_lowest
+        unpaired_first = 0
+        lowest_counts = self.pair_counts(0, 1).astype(float)
+        for folds in sorted({min(max(cutoff, 0), len(self)) for cutoff in cutoffs}):
+            if folds == 0:
+                yield folds, np.zeros([self.size, self.size]), np.zeros(self.size)
+                continue
+            pair_last = np.searchsorted(self.pair_rows, folds)
+            np.add.at(running, self.pair_cells[pair_first:pair_last], 1)
+            unpaired_last = np.searchsorted(self.unpaired_rows, folds)
+            np.add.at(unpaired, self.unpaired_nts[unpaired_first:unpaired_last], 1)
+            pair_first, unpaired_first = pair_last, unpaired_last
+            lowest = mark_lowest(lowest_counts.copy(), self.lowest_table, folds)
+            yield folds, (lowest + running.reshape(self.size, self.size)) / folds, unpaired.astype(float)
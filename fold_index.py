@@ -0,0 +1,142 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This module keeps a <trace file>_index.npz sidecar next to a trace file with
+# the byte offset and energy of every structure, so that structures n to m or all
+# structures within an energy window of the lowest energy are read with a seek and
+# a bounded read instead of parsing the whole file. mcff_submit and fold_prune
+# build the index while they write, other trace files are indexed in one pass.
+# The index belongs to the size and modification time of the trace file and is
+# rebuilt once they change
+# --------------------------------------------------------------------------------
+
+# -------
+# Imports
+# -------
+from fold_cache import parse_trace
+from fold_frequency import folds_within
+from fold_parse import bracket_pairs
+import numpy as np
+import os
+
+dotbracket_symbols = ('.' + ''.join(bracket_pairs) + ''.join(bracket_pairs.values())).encode()
+
+
+# -------
+# Classes
+# -------
+class IndexWriter:
+    # Collects the offsets and energies of the lines as they are written, save() once the trace file is closed
+    def __init__(self, trace_path):
+        self.trace_path = trace_path
+        self.offsets = [0]
+        self.energies = []
+
+    def add(self, line):
+        # The line exactly as written including the line break, str or bytes. A str is counted in UTF-8, which the trace
+        # files are written in. Blank lines are counted as part of the structure before them, any other line has to be
+        # a dot-bracket structure and its energy
+        size = len(line.encode()) if isinstance(line, str) else len(line)
+        item = line.split()
+        if not item:
+            self.offsets[-1] += size
+            return
+        structure = item[0].encode() if isinstance(item[0], str) else item[0]
+        try:
+            energy = None if structure.translate(None, dotbracket_symbols) else float(item[1])
+        except (IndexError, ValueError):
+            energy = None
+        if energy is None:  # E.g. a header line of mcff
+            raise ValueError(f'Line without a structure and an energy in {self.trace_path}: {line!r}')
+        self.offsets.append(self.offsets[-1] + size)
+        self.energies.append(energy)
+
+    def save(self):
+        save_index(self.trace_path, self.offsets, self.energies)
+
+
+class TraceIndex:
+    def __init__(self, trace_path):
+        self.trace_path = trace_path
+        self.index_path = trace_path + '_index.npz'
+        self.offsets = np.zeros(1, dtype=np.int64)     # Row n starts at offsets[n], the last entry is the file size
+        self.energies = np.array([], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.energies)
+
+    def load(self):
+        # True if the index exists and still belongs to the trace file
+        try:
+            trace_stat = os.stat(self.trace_path)
+            with np.load(self.index_path) as index:
+                if index['stamp'].tolist() != [trace_stat.st_size, trace_stat.st_mtime_ns]:
+                    return False
+                self.offsets = index['offsets']
+                self.energies = index['energies']
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+        return True
+
+    def build(self):
+        writer = IndexWriter(self.trace_path)
+        with open(self.trace_path, 'rb') as trace_file:
+            for line in trace_file:
+                writer.add(line)
+        writer.save()
+        self.offsets = np.array(writer.offsets, dtype=np.int64)
+        self.energies = np.array(writer.energies, dtype=np.float64)
+
+    def folds_within(self, energy_window):
+        return folds_within(self.energies, energy_window)
+
+    def read_bytes(self, start, stop):
+        # Text of structures start to stop - 1 (0-indexed)
+        start, stop = min(start, len(self)), min(stop, len(self))
+        with open(self.trace_path, 'rb') as trace_file:
+            trace_file.seek(int(self.offsets[start]))
+            return trace_file.read(int(self.offsets[stop] - self.offsets[start]))
+
+    def read_rows(self, start, stop):
+        # Same columns as fold_cache.read_trace for structures start to stop - 1
+        return parse_trace(self.read_bytes(start, stop).splitlines(keepends=True))
+
+    def copy_rows(self, output_path, stop):
+        # Writes the first stop structures to output_path together with their index, in blocks of 1 MB
+        stop = min(stop, len(self))
+        remaining = int(self.offsets[stop])
+        with open(self.trace_path, 'rb') as trace_file, open(output_path, 'wb') as output_file:
+            while remaining > 0:
+                block = trace_file.read(min(remaining, 1 << 20))
+                output_file.write(block)
+                remaining -= len(block)
+        save_index(output_path, self.offsets[:stop + 1], self.energies[:stop])
+
+
+# ---------
+# Functions
+# ---------
+def save_index(trace_path, offsets, energies):
+    # Every file is written under a temporary name first, so concurrent readers never see a half-written index
+    trace_stat = os.stat(trace_path)
+    temp_path = f'{trace_path}_index.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as index_file:
+        np.savez(index_file, offsets=np.asarray(offsets, dtype=np.int64),
+                 energies=np.asarray(energies, dtype=np.float64),
+                 stamp=np.array([trace_stat.st_size, trace_stat.st_mtime_ns], dtype=np.int64))
+    os.replace(temp_path, trace_path + '_index.npz')
+
+
+def save_column_index(trace_path, dotbrackets, energy_labels, energies):
+    # Index of a trace file just written from byte string columns as <dot-bracket> <energy label>\n lines
+    line_lengths = np.char.str_len(dotbrackets) + np.char.str_len(energy_labels) + 2
+    save_index(trace_path, np.concatenate([[0], np.cumsum(line_lengths)]), energies)
+
+
+def open_index(trace_path):
+    # Index of a trace file, built first if it is missing or stale
+    trace_index = TraceIndex(trace_path)
+    if not trace_index.load():
+        trace_index.build()
+    return trace_index
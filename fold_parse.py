@@ -0,0 +1,61 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This module turns dot-bracket structures from mc-fold 2.32 or mcff into pair
+# tables without building a forgi BulgeGraph for every structure. forgi is only
+# imported when the full graph is actually requested
+# --------------------------------------------------------------------------------
+
+# Closing -> opening bracket, the additional bracket types are used for pseudoknots
+bracket_pairs = {')': '(', ']': '[', '}': '{', '>': '<'}
+
+
+# ---------
+# Functions
+# ---------
+def dotbracket_to_pair_table(dotbracket):
+    # Same as forgi's to_pair_table()[1:]: 1-indexed partner for each nucleotide, 0 for unpaired nucleotides
+    pair_table = [0] * len(dotbracket)
+    stacks = {opening: [] for opening in bracket_pairs.values()}
+    for nt, symbol in enumerate(dotbracket, start=1):
+        if symbol in stacks:
+            stacks[symbol].append(nt)
+        elif symbol in bracket_pairs:
+            if not stacks[bracket_pairs[symbol]]:
+                raise ValueError(f'Unbalanced dot-bracket structure, no opening bracket for {symbol} at {nt}: '
+                                 f'{dotbracket}')
+            partner = stacks[bracket_pairs[symbol]].pop()
+            pair_table[nt - 1] = partner
+            pair_table[partner - 1] = nt
+        elif symbol != '.':
+            raise ValueError(f'Unknown symbol {symbol} at {nt} in dot-bracket structure: {dotbracket}')
+    for opening, stack in stacks.items():
+        if stack:
+            raise ValueError(f'Unbalanced dot-bracket structure, no closing bracket for {opening} at {stack[-1]}: '
+                             f'{dotbracket}')
+    return pair_table
+
+
+def has_single_bp_stem(pair_table):
+    # Same as forgi's length_one_stem_basepairs() != []: a base pair (i, j) is a stem of length one if neither
+    # (i + 1, j - 1) nor (i - 1, j + 1) is paired as well
+    length = len(pair_table)
+    for nt, partner in enumerate(pair_table, start=1):
+        if partner > nt:
+            inner_stacked = nt + 1 < partner - 1 and pair_table[nt] == partner - 1
+            outer_stacked = nt > 1 and partner < length and pair_table[nt - 2] == partner + 1
+            if not inner_stacked and not outer_stacked:
+                return True
+    return False
+
+
+def parse_dotbracket(dotbracket):
+    pair_table = dotbracket_to_pair_table(dotbracket)
+    return pair_table, has_single_bp_stem(pair_table)
+
+
+def load_bulge_graph(dotbracket):
+    # Only pay for the forgi/networkx import chain when the graph features are needed
+    import forgi.graph.bulge_graph as fgb
+    return fgb.BulgeGraph.from_dotbracket(dotbracket)
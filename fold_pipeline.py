@@ -0,0 +1,189 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This script runs mcff_submit, fold_prune, fold_dotplot and mcfold_fetch_images
+# one after another for a batch of sequences. A stage is skipped if its input
+# files and settings are unchanged since its last run, so e.g. a new plot setting
+# only redraws the plots. The settings of each stage are taken from its script
+# --------------------------------------------------------------------------------
+
+# Equal-length lists of directories, _complete file names and sequences, as in mcff_submit
+dir_names = ['/Users/chstei/Postdoc/E. coli ribosome/h23',
+             '/Users/chstei/Postdoc/E. coli ribosome/h23']
+file_names = ['h23-top_complete.out.txt',
+              'h23-top-GC_complete.out.txt']
+nt_seqs = ['GGUGUAGCGGUGAAAUGCGUAGAGACC',
+           'GUGUAGCGGUGAAAUGCGUAGAGAC']
+
+# Stages to run, later stages use the output of the earlier ones from previous runs if they are left out
+# Default: ['submit', 'prune', 'dotplot', 'fetch']
+run_stages = ['submit', 'prune', 'dotplot', 'fetch']
+# Number of sequences processed at the same time
+# Default: 4
+pipeline_workers = 4
+# Run all stages even if nothing has changed?
+# Default: False
+force = False
+
+# -------
+# Imports
+# -------
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fold_cache import TraceCache
+from fold_cli import apply_settings, restore_settings, settings_snapshot
+import fold_dotplot
+import fold_prune
+import hashlib
+import json
+import mcfold_fetch_images
+import mcff_submit
+import os
+import sys
+import time
+
+# Stage -> script and the settings of that script that change the output of the stage
+stage_settings = {'submit': (mcff_submit, ['energy_cutoff', 'predict_folds']),
+                  'prune': (fold_prune, []),
+                  'dotplot': (fold_dotplot, ['retain_folds', 'retain_energy', 'from_nt1', 'to_nt1', 'from_nt2',
+                                             'to_nt2', 'convergence_folds', 'plot_limits', 'save_figure', 'ext_figure',
+                                             'large_sequence', 'max_labels']),
+                  'fetch': (mcfold_fetch_images, ['download_folds', 'ext_figure', 'render_backend', 'url'])}
+
+
+# ---------
+# Functions
+# ---------
+def stage_key(stage, current_nt_seq, input_names):
+    # Content hash of everything the stage depends on: its settings, the sequence and its input files
+    script, settings = stage_settings[stage]
+    dependencies = {'stage': stage,
+                    'nt_seq': current_nt_seq,
+                    'settings': {setting: getattr(script, setting) for setting in settings},
+                    'inputs': {os.path.basename(input_name): TraceCache(input_name).content_hash()
+                               for input_name in input_names}}
+    return hashlib.sha256(json.dumps(dependencies, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def read_state(state_name):
+    try:
+        with open(state_name, 'r') as state_file:
+            return json.load(state_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_state(state_name, state):
+    with open(state_name + '.tmp', 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(state_name + '.tmp', state_name)
+
+
+def run_submit(current_dir_name, current_file_name, current_nt_seq):
+    store = mcff_submit.ResultStore(mcff_submit.result_store_name, mcff_submit.result_store_size) \
+        if mcff_submit.use_result_store else None
+    mcff_submit.stream_prune = False    # Pruning is a stage of its own here
+    mcff_submit.stored_job(store, current_dir_name, current_file_name, current_nt_seq)
+    return [current_dir_name + '/' + current_file_name]
+
+
+def run_prune(current_dir_name, current_file_name, current_nt_seq):
+    fold_prune.prune_file(current_dir_name, current_file_name)
+    return [current_dir_name + '/' + current_file_name.replace('complete', 'pruned')]
+
+
+def run_dotplot(current_dir_name, current_file_name, current_nt_seq):
+    pruned_name = current_file_name.replace('complete', 'pruned')
+    fold_dotplot.render_batch_file(current_dir_name, pruned_name, current_nt_seq)
+    if not fold_dotplot.save_figure:
+        return []
+    return [current_dir_name + '/' + pruned_name + '_' + plot_name + '.' + ext
+            for plot_name in fold_dotplot.plot_names for ext in fold_dotplot.ext_figure]
+
+
+def run_fetch(current_dir_name, current_file_name, current_nt_seq):
+    pruned_name = current_file_name.replace('complete', 'pruned')
+    target_name = current_dir_name + '/Downloads/' + pruned_name.split('.')[0]    # One folder per file
+    os.makedirs(target_name, exist_ok=True)
+    structures = mcfold_fetch_images.cut_structures(current_dir_name, pruned_name)
+    if mcfold_fetch_images.render_backend == 'local':
+        failed = mcfold_fetch_images.render_structures(structures, pruned_name, current_nt_seq, target_name)
+    else:
+        failed = mcfold_fetch_images.fetch_structures(structures, pruned_name, current_nt_seq, target_name,
+                                                      current_dir_name + '/image_cache')
+    if failed:
+        raise RuntimeError(f'{len(failed)} structure images could not be fetched: {sorted(failed)}')
+    exts = mcfold_fetch_images.ext_figure if mcfold_fetch_images.render_backend == 'local' \
+        else mcfold_fetch_images.ext_figure[:1]
+    return [mcfold_fetch_images.output_name(current_structure, ext, target_name)
+            for current_structure in structures for ext in exts]
+
+
+# Stage -> (function, input files relative to the _complete file name)
+stage_steps = {'submit': (run_submit, []),
+               'prune': (run_prune, ['complete']),
+               'dotplot': (run_dotplot, ['pruned']),
+               'fetch': (run_fetch, ['pruned'])}
+
+
+def run_sequence(current_dir_name, current_file_name, current_nt_seq):
+    # Runs the stages for one sequence in a worker process. Returns a list of (stage, status, runtime in s, message),
+    # a failed stage ends the pipeline for this sequence
+    state_name = current_dir_name + '/' + current_file_name + '_pipeline.json'
+    state = read_state(state_name)
+    results = []
+    for stage in run_stages:
+        started = time.perf_counter()
+        step, inputs = stage_steps[stage]
+        input_names = [current_dir_name + '/' + current_file_name.replace('complete', input_name)
+                       for input_name in inputs]
+        try:
+            key = stage_key(stage, current_nt_seq, input_names)
+        except FileNotFoundError as error:
+            results.append((stage, 'failed', None, f'missing input {error.filename}'))
+            break
+        previous = state.get(stage, {})
+        if not force and previous.get('key') == key and all(os.path.isfile(name) for name in previous['outputs']):
+            results.append((stage, 'skipped', None, ''))
+            continue
+        try:
+            outputs = step(current_dir_name, current_file_name, current_nt_seq)
+        except Exception as error:  # Anything a stage raises only ends the pipeline for this sequence
+            state.pop(stage, None)
+            write_state(state_name, state)
+            results.append((stage, 'failed', time.perf_counter() - started, f'{type(error).__name__}: {error}'))
+            break
+        state[stage] = {'key': key, 'outputs': outputs, 'finished': time.ctime()}
+        write_state(state_name, state)
+        results.append((stage, 'done', time.perf_counter() - started, ''))
+    return results
+
+
+def main(argv=None):
+    apply_settings(globals(), 'Run the submit, prune, dot plot and image stages for a batch of sequences, skipping '
+                              'unchanged stages', argv)
+    if not len(dir_names) == len(file_names) == len(nt_seqs):
+        print('# --------------------------------------------------------------------')
+        print('# Please provide individual directory and file names for each sequence')
+        print('# --------------------------------------------------------------------')
+        sys.exit()
+    if not all('complete' in current_file_name for current_file_name in file_names):
+        print('# ------------------------------------------------------------------------------------')
+        print('# Please use file names containing \'complete\', it is replaced by \'pruned\' for later stages')
+        print('# ------------------------------------------------------------------------------------')
+        sys.exit()
+
+    # The workers get the settings of this script and of the stage scripts as they are now, --set overrides included
+    snapshot = settings_snapshot(globals(), vars(fold_prune), vars(fold_dotplot), vars(mcfold_fetch_images),
+                                 vars(mcff_submit))
+    with ProcessPoolExecutor(pipeline_workers, initializer=restore_settings, initargs=(snapshot,)) as executor:
+        futures = {executor.submit(run_sequence, *job): job[1] for job in zip(dir_names, file_names, nt_seqs)}
+        for future in as_completed(futures):
+            print(f'{futures[future]}:')
+            for stage, status, runtime, message in future.result():
+                runtime = '' if runtime is None else f' ({round(runtime, 2)} s)'
+                print(f'  {stage.capitalize()}: {status}{runtime} {message}'.rstrip())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This module records wall and CPU time per processing stage and event counters
+# for a single trace file and writes them out as a JSON or CSV profile report
+# --------------------------------------------------------------------------------
+
+# -------
+# Imports
+# -------
+from contextlib import contextmanager
+import csv
+import json
+import time
+
+
+# -------
+# Classes
+# -------
+class StageProfiler:
+    def __init__(self, dir_name, file_name):
+        self.dir_name = dir_name
+        self.file_name = file_name
+        self.started = time.time()
+        self.stages = {}    # Stage name -> {'wall': s, 'cpu': s}, in the order the stages were first run
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        # CPU time only covers the current process, work handed to a process pool only shows up in the wall time
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            current_stage = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            current_stage['wall'] += time.perf_counter() - wall_start
+            current_stage['cpu'] += time.process_time() - cpu_start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        return {'dir_name': self.dir_name,
+                'file_name': self.file_name,
+                'started': time.ctime(self.started),
+                'stages': self.stages,
+                'counters': self.counters}
+
+    def write_report(self, report_name, formats=('json',)):
+        # report_name without extension, one file is written per requested format
+        for ext in formats:
+            if ext == 'json':
+                with open(report_name + '.json', 'w') as report_file:
+                    json.dump(self.as_dict(), report_file, indent=2)
+            elif ext == 'csv':
+                with open(report_name + '.csv', 'w', newline='') as report_file:
+                    writer = csv.writer(report_file)
+                    writer.writerow(['file_name', 'kind', 'name', 'wall_s', 'cpu_s', 'value'])
+                    for name, current_stage in self.stages.items():
+                        writer.writerow([self.file_name, 'stage', name,
+                                         round(current_stage['wall'], 6), round(current_stage['cpu'], 6), ''])
+                    for name, value in self.counters.items():
+                        writer.writerow([self.file_name, 'counter', name, '', '', value])
+            else:
+                raise ValueError(f'Unknown profile report format {ext}, use json or csv')
+
+    def summary(self):
+        lines = [f'{self.file_name}:']
+        for name, current_stage in self.stages.items():
+            lines.append(f'  {name.capitalize()} time: {round(current_stage["wall"], 3)} s '
+                         f'(CPU {round(current_stage["cpu"], 3)} s)')
+        for name, value in self.counters.items():
+            lines.append(f'  {name.replace("_", " ").capitalize()}: {value}')
+        return '\n'.join(lines)
@@ -10,145 +10,428 @@
 dir_names = ['/Users/chstei/Postdoc/E. coli ribosome/h23']
 file_names = ['h23-top_complete.out.txt']
 
-init = parse = make_table = single_bp = breathing = discard = write = 0
+# Algorithm for detecting basepair breathing, either 'index', 'numpy' for batched comparisons on a bp table matrix or
+# 'pairwise' for the original all-against-all comparison
+# Default: 'index'
+breathing_method = 'index'
+# Read, filter and write the structures one at a time instead of holding the whole trace file in memory?
+# Memory then only grows with the number of surviving structures. Breathing detection always uses the 'index' method
+# Default: False
+streaming = False
+# Number of worker processes. Several files are pruned in parallel, a single file is split up into chunks of structures
+# for the bp table construction and single-bp-bridge detection. The output is identical to the serial run
+# Default: 1
+workers = 1
+# Keep the parsed structures and bp tables in a binary <trace file>_cache folder next to each trace file? Later runs
+# and the other scripts then load them without parsing the text again. Not used in streaming mode
+# Default: True
+use_cache = True
+# Collapse the pruned structures further into clusters of structures within this base pair distance of a lower-energy
+# representative? The representatives are written to a _clustered file and the representative of every structure to
+# <clustered file>_members.csv. None switches clustering off. Not used in streaming mode
+# Default: None
+cluster_distance = None
+# Metric index for finding representatives within cluster_distance, either 'sketch' for a bucketed pair-set sketch or
+# 'bktree' for a BK-tree. Both give the same clusters, the sketch needs far fewer comparisons
+# Default: 'sketch'
+cluster_method = 'sketch'
+# Amount of progress output: 0 only prints the summary, 1 prints every structure as it is filtered and 2 additionally
+# traces every pairwise comparison down to the nucleotide level, which takes much longer than the pruning itself
+# Default: 0
+verbosity = 0
+# Write the stage timings and counters to <pruned file>_profile.<ext> next to the output?
+# Default: ['json'], supports ['json', 'csv'] at the same time or [] to switch the report off
+profile_report = ['json']
 
 # -------
 # Imports
 # -------
-import forgi.graph.bulge_graph as fgb
+from concurrent.futures import ProcessPoolExecutor
+from fold_cache import read_trace, text_columns, TraceCache
+from fold_cli import apply_settings, restore_settings, settings_snapshot
+from fold_cluster import cluster_structures
+from fold_index import IndexWriter, save_column_index
+from fold_parse import parse_dotbracket
+from fold_profile import StageProfiler
+import numpy as np
+import os
 import time
 
 
+# ---------------
+# Parallelization
+# ---------------
+stream_batch_size = 10000   # Structures per batch handed to the worker processes in streaming mode
+
+
+def map_dotbrackets(dotbrackets, pool=None):
+    # Yields (bp table, single-bp-bridge flag) for each structure, split up into one chunk per worker if a pool is given
+    if pool is None:
+        return map(parse_dotbracket, dotbrackets)
+    chunk_size = max(1, len(dotbrackets) // (workers * 4))
+    return pool.map(parse_dotbracket, dotbrackets, chunksize=chunk_size)
+
+
 # -------
 # Classes
 # -------
+class BreathingIndex:
+    # Two structures count as breathing neighbours if no nucleotide is paired to different partners in both of them.
+    # Each surviving structure is registered in an index of (nucleotide, partner) -> bitmask of surviving structures,
+    # so the survivors that conflict with a new structure are found with two bitwise operations per paired nucleotide.
+    # Every operation still covers all survivors, so this is the same survivors x nucleotides work as the pairwise
+    # scan, only done on whole machine words at a time. Memory grows with the number of survivors only, not with the
+    # number of structures offered
+    def __init__(self):
+        self.survivor_list = []     # Indices of structures that are neither bridges nor breathing, bit n in the masks
+        self.paired_mask = {}       # nucleotide -> survivors in which this nucleotide is paired
+        self.partner_mask = {}      # (nucleotide, partner) -> survivors containing exactly this base pair
+
+    def claim(self, index, pair_table):
+        # Structures have to be offered in energy order. Returns the index of the lowest-energy survivor the structure
+        # is breathing from, or None if the structure survives and is registered itself
+        conflict = 0
+        for nt, partner in enumerate(pair_table):
+            if partner != 0:
+                conflict |= self.paired_mask.get(nt, 0) & ~self.partner_mask.get((nt, partner), 0)
+        compatible = ((1 << len(self.survivor_list)) - 1) & ~conflict
+        if compatible:
+            return self.survivor_list[(compatible & -compatible).bit_length() - 1]
+        bit = 1 << len(self.survivor_list)
+        self.survivor_list.append(index)
+        for nt, partner in enumerate(pair_table):
+            if partner != 0:
+                self.paired_mask[nt] = self.paired_mask.get(nt, 0) | bit
+                self.partner_mask[(nt, partner)] = self.partner_mask.get((nt, partner), 0) | bit
+        return None
+
+
 class TraceFile:
+    # Columnar store: row n of each array holds the structure with the 1-indexed number n + 1 (mcfold online interface
+    # convention). Discarded structures are only switched off in the keep mask, nothing is removed from the arrays
+    __slots__ = ('dir_name', 'file_name', 'dotbrackets', 'energy_labels', 'energies', 'bp_table', 'single_bp',
+                 'keep', 'bridging_list', 'breathing_list', 'discard_list', 'profile', 'cache')
+
     def __init__(self, current_dir_name, current_file_name):
         self.dir_name = current_dir_name
         self.file_name = current_file_name
-        self.raw_list = []
+        self.dotbrackets = np.array([], dtype=bytes)     # Dot-bracket structures as fixed-width byte strings
+        self.energy_labels = np.array([], dtype=bytes)   # Energies exactly as written by mcff, used for the output
+        self.energies = np.array([], dtype=np.float64)
+        self.bp_table = np.zeros((0, 0), dtype=np.int16)    # (structures x nucleotides) 1-indexed partners, 0 unpaired
+        self.single_bp = np.array([], dtype=bool)           # Structures with single-bp-bridges
+        self.keep = np.array([], dtype=bool)
         self.bridging_list = []
         self.breathing_list = []
-        self.discard_list = []
+        self.discard_list = np.array([], dtype=np.int64)    # Indices of structures discarded due to bp breathing
+        self.profile = StageProfiler(current_dir_name, current_file_name)
+        self.cache = TraceCache(current_dir_name + '/' + current_file_name)
 
     def parse_input(self):
-        trace_data = self.dir_name + '/' + self.file_name
-        with open(trace_data, 'r') as trace_file:
-            self.raw_list = [[index,    # List with 1-indexed number [0] to match mcfold online interface convention,
-                              item[0],  # dot-bracket structure [1] and corresponding energy [2]
-                              item[1]]
-                             for index, item in enumerate((line.split(' ')
-                                                           for line in trace_file), start=1)]
-
-    def make_bp_table(self):
-        for current_structure in self.raw_list:
-            bg = fgb.BulgeGraph.from_dotbracket(current_structure[1])
-            current_structure.append(bg.to_pair_table()[1:])                # Add bp table [3] and boolean flag for
-            current_structure.append(bg.length_one_stem_basepairs() != [])  # single-bp-bridges [4] to the list
+        columns = self.cache.load(*text_columns) if use_cache else None
+        if columns is None:
+            columns = read_trace(self.dir_name + '/' + self.file_name)
+            self.profile.count('bytes_read', os.path.getsize(self.dir_name + '/' + self.file_name))
+            if use_cache:
+                self.cache.save(**columns)
+        else:
+            self.profile.count('cache_hits')
+        self.dotbrackets = columns['dotbrackets']
+        self.energy_labels = columns['energy_labels']
+        self.energies = columns['energies']
+        self.keep = np.ones(len(self.dotbrackets), dtype=bool)
+
+    def make_bp_table(self, pool=None):
+        columns = self.cache.load('bp_table', 'single_bp') if use_cache else None
+        if columns is not None:
+            self.profile.count('cache_hits')
+            self.bp_table = columns['bp_table']
+            self.single_bp = columns['single_bp']
+            return
+        # Shorter structures, if any, are padded as unpaired
+        self.bp_table = np.zeros((len(self.dotbrackets), self.dotbrackets.dtype.itemsize), dtype=np.int16)
+        self.single_bp = np.zeros(len(self.dotbrackets), dtype=bool)
+        for row, (pair_table, single_bp_stem) in enumerate(map_dotbrackets(np.char.decode(self.dotbrackets), pool)):
+            self.bp_table[row, :len(pair_table)] = pair_table
+            self.single_bp[row] = single_bp_stem
+        if use_cache:
+            self.cache.save(bp_table=self.bp_table, single_bp=self.single_bp)
 
     def remove_single_bp_bridges(self):
-        for current_structure in self.raw_list:
-            print('***************')
-            print('Index: ' + str(current_structure[0]))
-            print(current_structure[1])
-            if current_structure[4]:        # The boolean flag is used to sort out any structure with a single-bp-stem
-                self.bridging_list.append(current_structure[0])
-                print('Single-basepair bridge')
+        if verbosity >= 1:
+            for row, dotbracket in enumerate(np.char.decode(self.dotbrackets)):
+                print('***************')
+                print('Index: ' + str(row + 1))
+                print(dotbracket)
+                if self.single_bp[row]:
+                    print('Single-basepair bridge')
+        self.bridging_list.extend((np.flatnonzero(self.single_bp) + 1).tolist())   # Sort out any single-bp-stem
 
     def remove_bp_breathing(self):
-        for current_structure in self.raw_list:
-            print('***************')
-            print('Index: ' + str(current_structure[0]))
-            if current_structure[0] not in self.bridging_list and current_structure[0] not in self.breathing_list:
-                print(current_structure[1])
-                for next_structure in self.raw_list[current_structure[0]:]:  # The index stored in line[0] for each line of raw_list starts at 1, so starting from slice [0] here automatically counts up by 1
-                    print('---------------')
-                    print('Next: ' + str(next_structure[0]))
-                    if next_structure[0] not in self.bridging_list and next_structure[0] not in self.breathing_list:
-                        print(next_structure[1])
-                        for partner1, partner2 in zip(current_structure[3], next_structure[3]):
+        show_structures = verbosity >= 1
+        show_comparisons = verbosity >= 2   # Printing every compared nucleotide takes longer than the comparison itself
+        dotbrackets = np.char.decode(self.dotbrackets)
+        pair_tables = self.bp_table.tolist()
+        for current_index in range(1, len(pair_tables) + 1):
+            if show_structures:
+                print('***************')
+                print('Index: ' + str(current_index))
+            if current_index not in self.bridging_list and current_index not in self.breathing_list:
+                if show_structures:
+                    print(dotbrackets[current_index - 1])
+                for next_index in range(current_index + 1, len(pair_tables) + 1):
+                    if show_comparisons:
+                        print('---------------')
+                        print('Next: ' + str(next_index))
+                    if next_index not in self.bridging_list and next_index not in self.breathing_list:
+                        self.profile.count('comparisons')
+                        if show_comparisons:
+                            print(dotbrackets[next_index - 1])
+                        for partner1, partner2 in zip(pair_tables[current_index - 1], pair_tables[next_index - 1]):
                             difference = abs(partner1 - partner2)
-                            print(partner1, partner2, difference)
+                            if show_comparisons:
+                                print(partner1, partner2, difference)
                             if difference != 0 and difference != max(partner1, partner2):
-                                print('Different fold')
+                                if show_comparisons:
+                                    print('Different fold')
                                 break
                         else:
-                            self.breathing_list.append(next_structure[0])
-                            print('Basepair breathing')
-                    elif next_structure[0] in self.bridging_list:
-                        print('Skipped: Single-basepair bridge')
-                    else:
-                        print('Skipped: Basepair breathing')
-            else:
+                            self.breathing_list.append(next_index)
+                            if show_comparisons:
+                                print('Basepair breathing')
+                    elif show_comparisons:
+                        if next_index in self.bridging_list:
+                            print('Skipped: Single-basepair bridge')
+                        else:
+                            print('Skipped: Basepair breathing')
+            elif show_structures:
                 print('Skipped')
 
     def var_remove_bp_breathing(self):  # This implementation should do the same and might be slightly faster
-        for current_structure in self.raw_list:
-            print('***************')
-            print('Index: ' + str(current_structure[0]))
-            if current_structure[0] in self.bridging_list or current_structure[0] in self.breathing_list:
-                print('Skipped')
+        show_structures = verbosity >= 1
+        show_comparisons = verbosity >= 2   # Printing every compared nucleotide takes longer than the comparison itself
+        dotbrackets = np.char.decode(self.dotbrackets)
+        pair_tables = self.bp_table.tolist()
+        for current_index in range(1, len(pair_tables) + 1):
+            if show_structures:
+                print('***************')
+                print('Index: ' + str(current_index))
+            if current_index in self.bridging_list or current_index in self.breathing_list:
+                if show_structures:
+                    print('Skipped')
             else:
-                print(current_structure[1])
-                for next_structure in self.raw_list[current_structure[0]:]:  # The index stored in line[0] for each line of raw_list starts at 1, so starting from slice [0] here automatically counts up by 1
-                    print('---------------')
-                    print('Next: ' + str(next_structure[0]))
-                    if next_structure[0] in self.bridging_list:
-                        print('Skipped: Single-basepair bridge')
-                    elif next_structure[0] in self.breathing_list:
-                        print('Skipped: Basepair breathing')
+                if show_structures:
+                    print(dotbrackets[current_index - 1])
+                for next_index in range(current_index + 1, len(pair_tables) + 1):
+                    if show_comparisons:
+                        print('---------------')
+                        print('Next: ' + str(next_index))
+                    if next_index in self.bridging_list:
+                        if show_comparisons:
+                            print('Skipped: Single-basepair bridge')
+                    elif next_index in self.breathing_list:
+                        if show_comparisons:
+                            print('Skipped: Basepair breathing')
                     else:
-                        print(next_structure[1])
-                        for partner1, partner2 in zip(current_structure[3], next_structure[3]):
+                        self.profile.count('comparisons')
+                        if show_comparisons:
+                            print(dotbrackets[next_index - 1])
+                        for partner1, partner2 in zip(pair_tables[current_index - 1], pair_tables[next_index - 1]):
                             difference = abs(partner1 - partner2)
-                            print(partner1, partner2, difference)
+                            if show_comparisons:
+                                print(partner1, partner2, difference)
                             if difference != 0 and difference != max(partner1, partner2):
-                                print('Different fold')
+                                if show_comparisons:
+                                    print('Different fold')
                                 break
                         else:
-                            self.breathing_list.append(next_structure[0])
-                            print('Basepair breathing')
+                            self.breathing_list.append(next_index)
+                            if show_comparisons:
+                                print('Basepair breathing')
+
+    def index_remove_bp_breathing(self):  # Same result as var_remove_bp_breathing, all survivors at once on bitmasks
+        remaining = np.ones(len(self.bp_table), dtype=bool)
+        remaining[np.array(self.bridging_list, dtype=np.int64) - 1] = False
+        breathing_index = BreathingIndex()
+        claimed_list = []
+        for row in np.flatnonzero(remaining).tolist():
+            self.profile.count('comparisons', len(breathing_index.survivor_list))
+            claimed_by = breathing_index.claim(row + 1, self.bp_table[row].tolist())
+            if claimed_by is not None:
+                claimed_list.append((claimed_by, row + 1))
+        # The pairwise implementations list breathing structures grouped by the structure that claimed them
+        self.breathing_list.extend(index for _, index in sorted(claimed_list))
+
+    def numpy_remove_bp_breathing(self):  # Same result as var_remove_bp_breathing, one broadcast per surviving structure
+        remaining = np.ones(len(self.bp_table), dtype=bool)  # Structures that are neither bridges nor breathing (yet)
+        remaining[np.array(self.bridging_list, dtype=np.int64) - 1] = False
+        for row in range(len(self.bp_table)):
+            if not remaining[row]:
+                continue
+            later_rows = row + 1 + np.flatnonzero(remaining[row + 1:])
+            if later_rows.size == 0:
+                break
+            self.profile.count('comparisons', later_rows.size)
+            current_table = self.bp_table[row]
+            later_tables = self.bp_table[later_rows]
+            # A later structure is a different fold if any nucleotide is paired in both but to different partners
+            different = ((later_tables != current_table) & (later_tables != 0) & (current_table != 0)).any(axis=1)
+            breathing_rows = later_rows[~different]
+            remaining[breathing_rows] = False
+            self.breathing_list.extend((breathing_rows + 1).tolist())
 
     def discard_structures(self):
-        for line in sorted(self.bridging_list + self.breathing_list, reverse=True):
-            if line in self.bridging_list:
-                self.raw_list.pop(line - 1)
+        self.keep[np.array(self.bridging_list, dtype=np.int64) - 1] = False
+        self.discard_list = np.sort(np.array(self.breathing_list, dtype=np.int64))
+        self.keep[self.discard_list - 1] = False
+
+    # -----------------------------------------------------------------------------------------------
+    # Streaming pipeline: structures are read, filtered and written one at a time instead of via lists
+    # -----------------------------------------------------------------------------------------------
+    def read_structures(self, lines=None):
+        # Lines of the trace file, or of any other source in the same format such as a running mcff process
+        if lines is None:
+            self.profile.count('bytes_read', os.path.getsize(self.dir_name + '/' + self.file_name))
+            with open(self.dir_name + '/' + self.file_name, 'r') as trace_file:
+                yield from self.read_structures(trace_file)
+            return
+        for index, line in enumerate((line for line in lines if line.strip()), start=1):   # Blank lines are skipped
+            item = line.split(' ')
+            yield [index, item[0], item[1].rstrip()]    # 1-indexed number, dot-bracket structure and energy
+
+    def add_bp_tables(self, structures, pool=None):
+        # Structures are handed to the pool in batches, so that only one batch at a time is held in memory
+        batch = []
+        for current_structure in structures:
+            batch.append(current_structure)
+            if len(batch) == stream_batch_size:
+                yield from self.add_bp_tables_batch(batch, pool)
+                batch = []
+        yield from self.add_bp_tables_batch(batch, pool)
+
+    @staticmethod
+    def add_bp_tables_batch(batch, pool):
+        dotbrackets = [current_structure[1] for current_structure in batch]
+        for current_structure, parsed in zip(batch, map_dotbrackets(dotbrackets, pool)):
+            current_structure.extend(parsed)
+            yield current_structure
+
+    def skip_single_bp_bridges(self, structures):
+        for current_structure in structures:
+            if current_structure[4]:
+                self.profile.count('bridges_discarded')
+            else:
+                yield current_structure
+
+    def skip_bp_breathing(self, structures):
+        breathing_index = BreathingIndex()
+        for current_structure in structures:
+            self.profile.count('comparisons', len(breathing_index.survivor_list))
+            if breathing_index.claim(current_structure[0], current_structure[3]) is None:
+                yield current_structure
             else:
-                self.discard_list.append(self.raw_list.pop(line - 1))
+                self.profile.count('breathing_discarded')
+
+    def stream_output(self, pool=None, lines=None):
+        # Surviving structures are written as soon as they pass both filters, in the original energy order. lines
+        # replaces the trace file as the source, e.g. for pruning while mcff is still running
+        structures = self.skip_bp_breathing(self.skip_single_bp_bridges(self.add_bp_tables(self.read_structures(lines),
+                                                                                           pool)))
+        index_writer = IndexWriter(self.pruned_name())
+        with open(self.pruned_name(), 'w', encoding='utf-8', newline='\n') as pruned_file:  # Byte offsets as counted
+            for line in structures:
+                pruned_line = f'{line[1]} {line[2]}\n'
+                pruned_file.write(pruned_line)
+                index_writer.add(pruned_line)
+        index_writer.save()
+
+    def pruned_name(self):
+        return self.dir_name + '/' + self.file_name.replace('complete', 'pruned')
 
     def write_output(self):
-        with open(self.dir_name+'/'+self.file_name.replace('complete', 'pruned'), 'w') as pruned_file:
-            for line in self.raw_list:
-                pruned_file.write(f'{line[1]} {line[2]}\n')
+        with open(self.pruned_name(), 'wb') as pruned_file:
+            for dotbracket, energy_label in zip(self.dotbrackets[self.keep], self.energy_labels[self.keep]):
+                pruned_file.write(dotbracket + b' ' + energy_label + b'\n')
+        save_column_index(self.pruned_name(), self.dotbrackets[self.keep], self.energy_labels[self.keep],
+                          self.energies[self.keep])
+        if use_cache:   # The pruned file is cached right away for fold_dotplot and mcfold_fetch_images
+            TraceCache(self.pruned_name()).save(dotbrackets=self.dotbrackets[self.keep],
+                                                energy_labels=self.energy_labels[self.keep],
+                                                energies=self.energies[self.keep],
+                                                bp_table=self.bp_table[self.keep],
+                                                single_bp=self.single_bp[self.keep])
+
+    def clustered_name(self):
+        return self.dir_name + '/' + self.file_name.replace('complete', 'clustered')
 
+    def write_clusters(self):
+        # Clusters are formed among the structures that survived pruning, numbers in the members file are the 1-indexed
+        # numbers in the complete trace file
+        rows = np.flatnonzero(self.keep)
+        representatives, distances, metric_index = cluster_structures(self.bp_table[rows], cluster_distance,
+                                                                      cluster_method)
+        self.profile.count('cluster_comparisons', metric_index.comparisons)
+        self.profile.count('clusters', metric_index.size)
+        representative_rows = rows[representatives == np.arange(len(rows))]
+        with open(self.clustered_name(), 'wb') as clustered_file:
+            for row in representative_rows:
+                clustered_file.write(self.dotbrackets[row] + b' ' + self.energy_labels[row] + b'\n')
+        save_column_index(self.clustered_name(), self.dotbrackets[representative_rows],
+                          self.energy_labels[representative_rows], self.energies[representative_rows])
+        with open(self.clustered_name() + '_members.csv', 'w') as members_file:
+            members_file.write('structure,representative,distance\n')
+            for row, representative_row, distance in zip(rows.tolist(), rows[representatives].tolist(),
+                                                         distances.tolist()):
+                members_file.write(f'{row + 1},{representative_row + 1},{distance}\n')
 
-start = time.time()
-print(f'Started at {time.ctime(start)}\n')
 
-for dir_name, file_name in zip(dir_names, file_names):
+# ---------
+# Functions
+# ---------
+def prune_file(dir_name, file_name, pool=None):
+    # Returns the profile of the file. The pool, if given, is used to split up the bp table construction
     input_file = TraceFile(dir_name, file_name)
-    init = time.time()
+    profile = input_file.profile
+    if streaming:
+        with profile.stage('stream'):
+            input_file.stream_output(pool)
+    else:
 # -----------------------
 # Parse mcfold trace file
 # -----------------------
-    input_file.parse_input()
-    parse = time.time()
-    input_file.make_bp_table()
-    make_table = time.time()
+        with profile.stage('parse'):
+            input_file.parse_input()
+        with profile.stage('table'):
+            input_file.make_bp_table(pool)
 # -----------------------
 # Apply filter algorithms
 # -----------------------
-    input_file.remove_single_bp_bridges()
-    single_bp = time.time()
-    input_file.var_remove_bp_breathing()
-    breathing = time.time()
-    input_file.discard_structures()
-    discard = time.time()
+        with profile.stage('single'):
+            input_file.remove_single_bp_bridges()
+        with profile.stage('breathing'):
+            if breathing_method == 'pairwise':
+                input_file.var_remove_bp_breathing()
+            elif breathing_method == 'numpy':
+                input_file.numpy_remove_bp_breathing()
+            else:
+                input_file.index_remove_bp_breathing()
+        with profile.stage('discard'):
+            input_file.discard_structures()
+        profile.count('bridges_discarded', len(input_file.bridging_list))
+        profile.count('breathing_discarded', len(input_file.breathing_list))
 # -----------------
 # Write output file
 # -----------------
-    input_file.write_output()
-    write = time.time()
+        with profile.stage('write'):
+            input_file.write_output()
+        if cluster_distance is not None:
+            with profile.stage('cluster'):
+                input_file.write_clusters()
+    profile.count('bytes_written', os.path.getsize(input_file.pruned_name()))
+    if profile_report:
+        profile.write_report(input_file.pruned_name() + '_profile', profile_report)
+    return profile
+
 
 # -----------------------
 # Parse mcfold trace file
@@ -226,15 +509,33 @@ for dir_name, file_name in zip(dir_names, file_names):
 #     for line in raw_list:
 #         pruned_file.write('{0} {1}\n'.format(line[1], line[2]))
 
-finish = time.time()
-print(f'\nFinished at {time.ctime(finish)}')
 
-print(f'Init time: {round(init - start, 3)} s')
-print(f'Parse time: {round(parse - init, 3)} s')
-print(f'Table time: {round(make_table - parse, 3)} s')
-print(f'Single time: {round(single_bp - make_table, 3)} s')
-print(f'Breathing time: {round(breathing - single_bp, 3)} s')
-print(f'Discard time: {round(discard - breathing, 3)} s')
-print(f'Write time: {round(write - discard, 3)} s')
+def main(argv=None):
+    apply_settings(globals(), 'Prune single-bp-bridges and base pair breathing from mcff trace files', argv)
+    start = time.time()
+    print(f'Started at {time.ctime(start)}\n')
+
+    if workers > 1 and len(file_names) > 1:
+        # Whole files are pruned in parallel, each worker processes its file serially
+        with ProcessPoolExecutor(max_workers=workers, initializer=restore_settings,
+                                 initargs=(settings_snapshot(globals()),)) as executor:
+            profiles = list(executor.map(prune_file, dir_names, file_names))
+    elif workers > 1:
+        # A single file is split up into chunks of structures for the bp table construction
+        with ProcessPoolExecutor(max_workers=workers, initializer=restore_settings,
+                                 initargs=(settings_snapshot(globals()),)) as executor:
+            profiles = [prune_file(dir_names[0], file_names[0], executor)]
+    else:
+        profiles = [prune_file(dir_name, file_name) for dir_name, file_name in zip(dir_names, file_names)]
+
+    finish = time.time()
+    print(f'Finished at {time.ctime(finish)}\n')
+
+    for profile in profiles:
+        print(profile.summary())
+
+    print(f'\nElapsed time: {round(finish - start, 3)} s')
+
 
-print(f'Elapsed time: {round(finish - start, 3)} s')
+if __name__ == '__main__':  # Worker processes import this module, only the main process runs the batch
+    main()
@@ -0,0 +1,118 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This module draws secondary structure images from a dot-bracket structure and
+# its sequence without the mcfold website. The layout follows the simple radial
+# layout of RNAplot: loops are regular polygons and stems are straight ladders
+# --------------------------------------------------------------------------------
+
+# -------
+# Imports
+# -------
+from fold_parse import dotbracket_to_pair_table
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+
+nt_colors = {'A': '#64b964', 'C': '#5a96c8', 'G': '#f0be5a', 'U': '#e6645a'}
+
+
+# ---------
+# Functions
+# ---------
+def layout_angles(pair_table):
+    # Turning angle of the backbone at every nucleotide, pair_table is 1-indexed with the length in [0] and padded
+    # with an unpaired nucleotide on both ends, so the exterior loop is handled like every other loop
+    angles = np.zeros(len(pair_table) + 1)
+    pending = [(0, len(pair_table) - 1)]
+    while pending:
+        i, j = pending.pop()
+        i_old = i - 1
+        j += 1
+        count = 2
+        remember = []
+        while i != j:
+            partner = pair_table[i]
+            if partner == 0 or i == 0:
+                i += 1
+                count += 1
+            else:
+                count += 2
+                k, l = i, partner
+                remember += [k, l]
+                i = partner + 1
+                ladder = 0
+                while True:     # Walk to the end of the stem
+                    k += 1
+                    l -= 1
+                    ladder += 1
+                    if not (pair_table[k] == l and pair_table[k] > k):
+                        break
+                fill = ladder - 2
+                if ladder >= 2:
+                    angles[remember[-2] + 1 + fill] += np.pi / 2
+                    angles[remember[-1] - 1 - fill] += np.pi / 2
+                    angles[remember[-2]] += np.pi / 2
+                    angles[remember[-1]] += np.pi / 2
+                    for fill in range(fill, 0, -1):
+                        angles[remember[-2] + fill] = np.pi
+                        angles[remember[-1] - fill] = np.pi
+                if k <= l:
+                    pending.append((k, l))
+        polygon = np.pi * (count - 2) / count
+        remember.append(j)
+        begin = max(i_old, 0)
+        for v in range(0, len(remember), 2):
+            angles[begin:remember[v] + 1] += polygon
+            if v + 1 < len(remember):
+                begin = remember[v + 1]
+    return angles
+
+
+def layout_coordinates(dotbracket):
+    # x and y of every nucleotide, neighbouring nucleotides are 1 apart
+    length = len(dotbracket)
+    pair_table = [length] + dotbracket_to_pair_table(dotbracket) + [0]
+    angles = layout_angles(pair_table)
+    turns = np.pi - angles[2:length + 1]
+    directions = np.concatenate([[np.pi - angles[1]], np.pi - angles[1] + np.cumsum(turns)])
+    x = np.concatenate([[0], np.cumsum(np.cos(directions[:-1]))])
+    y = np.concatenate([[0], np.cumsum(np.sin(directions[:-1]))])
+    return x, y
+
+
+def draw_structure(figure, current_nt_seq, dotbracket, title):
+    figure.clf()
+    layer = figure.add_subplot()
+    x, y = layout_coordinates(dotbracket)
+    pair_table = dotbracket_to_pair_table(dotbracket)
+    layer.plot(x, y, color='0.6', linewidth=1, zorder=1)   # Backbone
+    for nt, partner in enumerate(pair_table, start=1):
+        if partner > nt:
+            layer.plot([x[nt - 1], x[partner - 1]], [y[nt - 1], y[partner - 1]], color='k', linewidth=1.5, zorder=1)
+    layer.scatter(x, y, s=120, c=[nt_colors.get(nt, 'w') for nt in current_nt_seq], edgecolors='k', linewidths=0.5,
+                  zorder=2)
+    for nt, (nt_x, nt_y) in enumerate(zip(x, y), start=1):
+        layer.annotate(current_nt_seq[nt - 1], (nt_x, nt_y), ha='center', va='center', fontsize=6, zorder=3)
+        if nt == 1 or nt % 10 == 0:     # Number every tenth nucleotide next to it, away from the centre of the plot
+            offset = np.array([nt_x - x.mean(), nt_y - y.mean()])
+            offset = offset / (np.linalg.norm(offset) or 1)
+            layer.annotate(str(nt), (nt_x, nt_y), xytext=offset * 12, textcoords='offset points', ha='center',
+                           va='center', fontsize=6, color='0.3')
+    layer.set_title(title, fontsize=8)
+    layer.set_aspect('equal')
+    layer.margins(0.08)
+    layer.set_axis_off()
+    size = 2 + 0.15 * np.sqrt(len(current_nt_seq)) * 4     # Grow with the spread of the layout
+    figure.set_size_inches(size, size)
+
+
+def render_structure(output_file, current_nt_seq, dotbracket, title, figure=None):
+    # Headless rendering to output_file, the format follows its extension. A figure can be passed in for reuse
+    if figure is None:
+        figure = Figure()
+        FigureCanvasAgg(figure)
+    draw_structure(figure, current_nt_seq, dotbracket, title)
+    figure.savefig(output_file)
+    return output_file
@@ -0,0 +1,133 @@
+# --------------------------------------------------------------------------------
+# Version: 2026-10-18
+# Author: Christian Steinmetzger, Petzold group
+#
+# This module writes synthetic trace files in the mcff output format for testing
+# and benchmarking without mcff: unique, nested dot-bracket structures sorted by
+# energy, with a given share of base pair breathing variants of earlier
+# structures and of structures with single-basepair bridges
+# --------------------------------------------------------------------------------
+
+# -------
+# Imports
+# -------
+import random
+
+
+# ---------
+# Functions
+# ---------
+def random_dotbracket(length, rng, stem_rate=0.15):
+    # Nested stems of 2-6 bp with hairpins of at least 3 nt, so the structure has no single-bp-bridges
+    dotbracket = ['.'] * length
+    pending = [(0, length)]
+    while pending:
+        start, stop = pending.pop()
+        nt = start
+        while nt < stop:
+            if stop - nt >= 7 and rng.random() < stem_rate:
+                stem = rng.randint(2, min(6, (stop - nt - 3) // 2))
+                partner = rng.randint(nt + 2 * stem + 2, min(stop - 1, nt + 2 * stem + 2 + 40))
+                for offset in range(stem):
+                    dotbracket[nt + offset] = '('
+                    dotbracket[partner - offset] = ')'
+                pending.append((nt + stem, partner - stem + 1))
+                nt = partner + 1
+            else:
+                nt += 1
+    return ''.join(dotbracket)
+
+
+def stems(dotbracket):
+    # (5' start, 3' end, length) of each stem
+    pair_table = [0] * len(dotbracket)
+    stack = []
+    for nt, symbol in enumerate(dotbracket):
+        if symbol == '(':
+            stack.append(nt)
+        elif symbol == ')':
+            partner = stack.pop()
+            pair_table[nt] = partner
+            pair_table[partner] = nt
+    found = []
+    nt = 0
+    while nt < len(dotbracket):
+        if dotbracket[nt] == '(':
+            partner = pair_table[nt]
+            length = 1
+            while dotbracket[nt + length] == '(' and pair_table[nt + length] == partner - length:
+                length += 1
+            found.append((nt, partner, length))
+            nt += length
+        else:
+            nt += 1
+    return found
+
+
+def breathing_variant(dotbracket, rng):
+    # Opens the outer base pair of a stem of at least 3 bp or closes an additional one next to a stem. The variant pairs
+    # no nucleotide differently than the original, so it counts as base pair breathing. None if neither is possible
+    options = []
+    for start, end, length in stems(dotbracket):
+        if length >= 3:
+            options.append((start, end, '.', '.'))
+        if start > 0 and end < len(dotbracket) - 1 and dotbracket[start - 1] == '.' and dotbracket[end + 1] == '.':
+            options.append((start - 1, end + 1, '(', ')'))
+    if not options:
+        return None
+    start, end, opening, closing = rng.choice(options)
+    return dotbracket[:start] + opening + dotbracket[start + 1:end] + closing + dotbracket[end + 1:]
+
+
+def bridge_variant(dotbracket, rng):
+    # Adds a single-bp-bridge within a run of at least 7 unpaired nucleotides, None if there is none
+    runs = []
+    nt = 0
+    while nt < len(dotbracket):
+        stop = nt
+        while stop < len(dotbracket) and dotbracket[stop] == '.':
+            stop += 1
+        if stop - nt >= 7:
+            runs.append((nt, stop))
+        nt = stop + 1
+    if not runs:
+        return None
+    start, stop = rng.choice(runs)
+    nt = rng.randint(start + 1, stop - 6)
+    partner = rng.randint(nt + 4, stop - 2)
+    return dotbracket[:nt] + '(' + dotbracket[nt + 1:partner] + ')' + dotbracket[partner + 1:]
+
+
+def make_trace(length, count, breathing_rate=0.3, bridge_rate=0.1, seed=0):
+    # List of count (dot-bracket, energy label) tuples in ascending energy order
+    rng = random.Random(seed)
+    structures = []
+    seen = set()
+    attempts = 0
+    while len(structures) < count:
+        attempts += 1
+        if attempts > 100 * count:
+            raise ValueError(f'Could not find {count} different structures of {length} nt')
+        draw = rng.random()
+        if structures and draw < breathing_rate:
+            dotbracket = breathing_variant(rng.choice(structures), rng)
+        elif structures and draw < breathing_rate + bridge_rate:
+            dotbracket = bridge_variant(rng.choice(structures), rng)
+        else:
+            dotbracket = random_dotbracket(length, rng)
+        if dotbracket is not None and dotbracket not in seen:
+            seen.add(dotbracket)
+            structures.append(dotbracket)
+    energy = -30.0 - length / 10
+    trace = []
+    for dotbracket in structures:    # Variants always come after the structure they were made from, as in mcff output
+        trace.append((dotbracket, f'{energy:.2f}'))
+        energy += rng.expovariate(count / 5)    # Spread the structures over about 5 kcal/mol
+    return trace
+
+
+def write_trace(trace_path, length, count, breathing_rate=0.3, bridge_rate=0.1, seed=0):
+    with open(trace_path, 'w') as trace_file:
+        for dotbracket, energy_label in make_trace(length, count, breathing_rate, bridge_rate, seed):
+            trace_file.write(f'{dotbracket} {energy_label}\n')
+    return trace_path
@@ -21,38 +21,355 @@ nt_seq = ['GGUGUAGCGGUGAAAUGCGUAGAGACC',
 energy_cutoff = None
 predict_folds = 1000
 
+# Number of mcff processes running at the same time
+# Default: 4
+mcff_workers = 4
+# Time limit in s for a single mcff run, after which it is stopped and reported as failed. None for no limit
+# Default: None
+mcff_timeout = None
+
+# Write the mcff output to the file line by line while mcff is still running instead of holding all of it in memory?
+# Default: True
+streaming = True
+# Also run the fold_prune filters on the streamed structures, so that the _pruned file is written at the same time?
+# fold_prune's settings apply, breathing detection always uses the 'index' method. File names have to contain 'complete'
+# Default: False
+stream_prune = False
+
+# Keep the output of every mcff run in a result store and reuse it for the same sequence and settings? A request for
+# the top n structures is also served from a stored run with more structures
+# Default: True
+use_result_store = True
+# Location of the result store, shared by all batches
+# Default: '~/mcff_store'
+result_store_name = '~/mcff_store'
+# Maximum size of the result store in bytes, the least recently used results are removed first
+# Default: 10 * 1024**3 (10 GB)
+result_store_size = 10 * 1024**3
+
 # -------
 # Imports
 # -------
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fold_cli import apply_settings
+from fold_index import IndexWriter, open_index
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+# fold_prune is only imported for stream_prune
 
-if not len(dir_name) == len(file_name) == len(nt_seq):
-    print('# --------------------------------------------------------------------')
-    print('# Please provide individual directory and file names for each sequence')
-    print('# --------------------------------------------------------------------')
-    sys.exit()
 
+# -------
+# Classes
+# -------
+class ResultStore:
+    # Stored outputs are <sha256 of the key>.out.txt files with the header lines already removed, each with its
+    # fold_index sidecar. index.json holds the sequence, mode, parameter, mcff version, size and last use of each of them.
+    # Several processes (e.g. fold_pipeline workers) can share the store, so index.json is re-read under an exclusive
+    # lock on index.lock before every change and written before the lock is released
+    def __init__(self, store_name, max_size):
+        self.store_name = os.path.expanduser(store_name)
+        self.index_path = self.store_name + '/index.json'
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(self.store_name, exist_ok=True)
+        self.index = self.read_index()
+        self.version = mcff_version()
 
-for dir_name, file_name, nt_seq in zip(dir_name, file_name, nt_seq):
-    try:
-        with open(dir_name+'/'+file_name, 'w') as output_file:
-            if predict_folds is None:
-                mcff_output = subprocess.check_output(f'mcff -s {nt_seq} -t {energy_cutoff}', shell=True, text=True)
-            elif energy_cutoff is None:
-                # Requesting a defined number of output structures adds four lines to the top of the output that need to
-                # be removed before the file is written
-                mcff_output_raw = subprocess.check_output(f'mcff -s {nt_seq} -ft {predict_folds} -v2', shell=True, text=True)
-                mcff_output_cleaned = mcff_output_raw.splitlines(keepends=True)[4:]
-                mcff_output = ''.join(mcff_output_cleaned)
-            else:
-                print('# ------------------------------------------------------------------------------------')
-                print('# Please request either an energy range or a number of suboptimal structures, not both')
-                print('# ------------------------------------------------------------------------------------')
+    def read_index(self):
+        try:
+            with open(self.index_path, 'r') as index_file:
+                return json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @contextlib.contextmanager
+    def locked(self):
+        with self.lock, open(self.store_name + '/index.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)   # Released when the lock file is closed
+            self.index = self.read_index()
+            yield
+
+    def make_key(self, current_nt_seq, mode, parameter):
+        return hashlib.sha256('|'.join([current_nt_seq, mode, str(parameter), self.version]).encode()).hexdigest()
+
+    def write_index(self):
+        temp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as index_file:
+            json.dump(self.index, index_file, indent=1)
+        os.replace(temp_path, self.index_path)
+
+    def find(self, current_nt_seq, mode, parameter):
+        # Key of a stored run that covers the request: the same run, or for the top n structures any run of the same
+        # sequence with at least n structures
+        key = self.make_key(current_nt_seq, mode, parameter)
+        if key in self.index:
+            return key
+        if mode == 'ft':
+            larger = [(entry['parameter'], other_key) for other_key, entry in self.index.items()
+                      if entry['nt_seq'] == current_nt_seq and entry['mode'] == 'ft'
+                      and entry['version'] == self.version and entry['parameter'] >= parameter]
+            if larger:
+                return min(larger)[1]
+        return None
+
+    def fetch(self, current_nt_seq, mode, parameter, output_name):
+        # Writes the stored result to output_name and returns True, or returns False if there is none
+        with self.locked():
+            key = self.find(current_nt_seq, mode, parameter)
+            if key is None or not os.path.isfile(self.store_name + '/' + key + '.out.txt'):
+                return False
+            self.index[key]['used'] = time.time()
+            self.write_index()
+            stored_name = self.store_name + '/' + key + '.out.txt'
+        try:
+            stored_index = open_index(stored_name)
+            # Top n structures of a larger run, or the whole run for an energy cutoff
+            stored_index.copy_rows(output_name, parameter if mode == 'ft' else len(stored_index))
+        except FileNotFoundError:   # Evicted by another process in the meantime
+            return False
+        return True
+
+    def add(self, current_nt_seq, mode, parameter, output_name):
+        key = self.make_key(current_nt_seq, mode, parameter)
+        temp_path = f'{self.store_name}/{key}.{os.getpid()}.{threading.get_ident()}.tmp'
+        output_index = open_index(output_name)
+        output_index.copy_rows(temp_path, len(output_index))
+        os.replace(temp_path, self.store_name + '/' + key + '.out.txt')
+        os.replace(temp_path + '_index.npz', self.store_name + '/' + key + '.out.txt_index.npz')
+        with self.locked():
+            self.index[key] = {'nt_seq': current_nt_seq, 'mode': mode, 'parameter': parameter, 'version': self.version,
+                               'size': os.path.getsize(self.store_name + '/' + key + '.out.txt'), 'used': time.time()}
+            self.evict(keep=key)
+            self.write_index()
+
+    def evict(self, keep):
+        total_size = sum(entry['size'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda key: self.index[key]['used']):
+            if total_size <= self.max_size:
                 break
-            output_file.write(mcff_output)
-    except FileNotFoundError:
-        print('# ----------------------------------------------------' + '-' * len(dir_name))
-        print(f'# Please create the folder {dir_name} before running this script')
-        print('# ----------------------------------------------------' + '-' * len(dir_name))
-        break
+            if key == keep:
+                continue
+            total_size -= self.index.pop(key)['size']
+            for stored_name in [key + '.out.txt', key + '.out.txt_index.npz']:
+                try:
+                    os.remove(self.store_name + '/' + stored_name)
+                except FileNotFoundError:
+                    pass
+
+
+# ---------
+# Functions
+# ---------
+def mcff_version():
+    # The mcff executable itself identifies the version, so results of a different build are never reused
+    mcff_path = shutil.which('mcff')
+    if mcff_path is None:
+        return 'missing'
+    digest = hashlib.sha256()
+    with open(mcff_path, 'rb') as mcff_file:
+        for block in iter(lambda: mcff_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def mcff_mode():
+    # Mode and parameter of the request, as used for the result store
+    return ('t', energy_cutoff) if predict_folds is None else ('ft', predict_folds)
+
+
+def mcff_command(current_nt_seq):
+    if predict_folds is None:
+        return ['mcff', '-s', current_nt_seq, '-t', str(energy_cutoff)]
+    return ['mcff', '-s', current_nt_seq, '-ft', str(predict_folds), '-v2']
+
+
+def remove_outputs(output_names):
+    for output_name in output_names:
+        try:
+            os.remove(output_name)
+        except FileNotFoundError:
+            pass
+
+
+def run_job(current_dir_name, current_file_name, current_nt_seq):
+    # Runs mcff for one sequence and writes its output, returns the runtime in s. Errors are raised to the scheduler
+    started = time.perf_counter()
+    output_name = current_dir_name + '/' + current_file_name
+    index_writer = IndexWriter(output_name)
+    try:
+        with open(output_name, 'w', encoding='utf-8', newline='\n') as output_file:   # Byte offsets as counted
+            mcff_output = subprocess.run(mcff_command(current_nt_seq), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                         text=True, timeout=mcff_timeout, check=True).stdout
+            mcff_lines = mcff_output.splitlines(keepends=True)
+            if predict_folds is not None:
+                # Requesting a defined number of output structures adds four lines to the top of the output that need
+                # to be removed before the file is written
+                mcff_lines = mcff_lines[4:]
+            for line in mcff_lines:
+                if line.strip():    # Blank lines are left out of the trace file
+                    output_file.write(line)
+                    index_writer.add(line)
+    except BaseException:
+        remove_outputs([output_name])   # Don't leave a partial output file behind that looks like a finished job
+        raise
+    index_writer.save()
+    return time.perf_counter() - started
+
+
+def stream_lines(process, output_file, index_writer):
+    # Passes the structures on as mcff writes them, after writing each of them to the output file and its index
+    for number, line in enumerate(process.stdout):
+        if predict_folds is not None and number < 4:   # Header lines of a defined number of output structures
+            continue
+        if not line.strip():    # Blank lines are left out of the trace file
+            continue
+        output_file.write(line)
+        index_writer.add(line)
+        yield line
+
+
+def stream_job(current_dir_name, current_file_name, current_nt_seq):
+    # Same as run_job, but mcff's output goes to the file (and into the pruning filters) as it arrives. The output files
+    # are removed again if anything goes wrong, so a partial file never looks like a finished job
+    started = time.perf_counter()
+    output_names = [current_dir_name + '/' + current_file_name]
+    index_writer = IndexWriter(output_names[0])
+    try:
+        with open(output_names[0], 'w', encoding='utf-8', newline='\n') as output_file, \
+                tempfile.TemporaryFile('w+') as error_file:
+            run_stream(current_dir_name, current_file_name, current_nt_seq, output_file, error_file, index_writer,
+                       output_names)
+    except BaseException:
+        remove_outputs(output_names)
+        raise
+    index_writer.save()
+    return time.perf_counter() - started
+
+
+def run_stream(current_dir_name, current_file_name, current_nt_seq, output_file, error_file, index_writer,
+               output_names):
+    # stderr goes to a file so that a full pipe can never block mcff while stdout is being read
+    process = subprocess.Popen(mcff_command(current_nt_seq), stdout=subprocess.PIPE, stderr=error_file, text=True)
+    timed_out = threading.Event()
+    timer = threading.Timer(mcff_timeout, lambda: (timed_out.set(), process.kill())) \
+        if mcff_timeout is not None else None
+    try:
+        if timer is not None:
+            timer.start()
+        if stream_prune:
+            import fold_prune
+            trace_file = fold_prune.TraceFile(current_dir_name, current_file_name)
+            output_names.append(trace_file.pruned_name())
+            trace_file.stream_output(lines=stream_lines(process, output_file, index_writer))
+        else:
+            for _ in stream_lines(process, output_file, index_writer):
+                pass
+        returncode = process.wait()
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+        process.stdout.close()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(process.args, mcff_timeout)
+    if returncode != 0:
+        error_file.seek(0)
+        raise subprocess.CalledProcessError(returncode, process.args, stderr=error_file.read())
+
+
+def stored_job(store, current_dir_name, current_file_name, current_nt_seq):
+    # Serves the job from the result store if possible, otherwise runs mcff and stores the result. Returns the status
+    # and the runtime in s
+    started = time.perf_counter()
+    output_name = current_dir_name + '/' + current_file_name
+    if store is not None and store.fetch(current_nt_seq, *mcff_mode(), output_name):
+        if stream_prune:
+            import fold_prune
+            fold_prune.TraceFile(current_dir_name, current_file_name).stream_output()
+        return 'stored', time.perf_counter() - started
+    runtime = (stream_job if streaming else run_job)(current_dir_name, current_file_name, current_nt_seq)
+    if store is not None:
+        store.add(current_nt_seq, *mcff_mode(), output_name)
+    return 'done', runtime
+
+
+def run_jobs(jobs):
+    # Runs mcff_workers jobs at the same time, a failing job doesn't affect the others. Returns a list of
+    # (output file, (status, runtime in s, message)) in the order of the jobs. Mutant series usually reuse the same file
+    # name in different folders, so jobs are told apart by their position
+    results = {}
+    store = ResultStore(result_store_name, result_store_size) if use_result_store else None
+    with ThreadPoolExecutor(mcff_workers) as pool:     # The work happens in the mcff processes, threads only wait
+        futures = {pool.submit(stored_job, store, *job): number for number, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            number = futures[future]
+            current_dir_name, current_file_name, current_nt_seq = jobs[number]
+            try:
+                results[number] = (*future.result(), '')
+            except subprocess.TimeoutExpired:
+                results[number] = ('timeout', mcff_timeout, f'stopped after {mcff_timeout} s')
+            except subprocess.CalledProcessError as error:
+                results[number] = ('failed', None, f'mcff exit status {error.returncode}: {error.stderr.strip()}')
+            except FileNotFoundError as error:
+                if error.filename == 'mcff':
+                    message = 'mcff was not found, please make sure it is on the PATH'
+                else:
+                    message = f'please create the folder {current_dir_name} before running this script'
+                results[number] = ('failed', None, message)
+            except (OSError, ValueError) as error:
+                results[number] = ('failed', None, str(error))
+            print(f'Finished {len(results)}/{len(futures)} jobs: {current_dir_name}/{current_file_name} '
+                  f'{results[number][0]}')
+    return [(job[0] + '/' + job[1], results[number]) for number, job in enumerate(jobs)]
+
+
+def print_summary(results, wall_time):
+    width = max((len(output_name) for output_name, _ in results), default=0)   # No jobs if no sequences are given
+    print('# ' + '-' * (width + 24))
+    for output_name, (status, runtime, message) in results:
+        runtime = '' if runtime is None else f'{round(runtime, 2)} s'
+        print(f'# {output_name:<{width}}  {status:<8}{runtime:>12}  {message}')
+    print('# ' + '-' * (width + 24))
+    done = [runtime for _, (status, runtime, _) in results if status == 'done']
+    stored = [runtime for _, (status, runtime, _) in results if status == 'stored']
+    print(f'# {len(done) + len(stored)}/{len(results)} jobs done in {round(wall_time, 2)} s '
+          f'({round(sum(done), 2)} s mcff runtime with {mcff_workers} workers, {len(stored)} from the result store)')
+
+
+def main(argv=None):
+    apply_settings(globals(), 'Run mcff for a batch of sequences', argv)
+    if not len(dir_name) == len(file_name) == len(nt_seq):
+        print('# --------------------------------------------------------------------')
+        print('# Please provide individual directory and file names for each sequence')
+        print('# --------------------------------------------------------------------')
+        sys.exit()
+    if stream_prune and not all('complete' in current_file_name for current_file_name in file_name):
+        print('# ------------------------------------------------------------------------------------')
+        print('# Please use file names containing \'complete\' for pruning, it is replaced by \'pruned\'')
+        print('# ------------------------------------------------------------------------------------')
+        sys.exit()
+    if (energy_cutoff is None) == (predict_folds is None):
+        print('# ------------------------------------------------------------------------------------')
+        print('# Please request either an energy range or a number of suboptimal structures, not both')
+        print('# ------------------------------------------------------------------------------------')
+        sys.exit()
+
+    batch_started = time.perf_counter()
+    job_results = run_jobs(list(zip(dir_name, file_name, nt_seq)))
+    print_summary(job_results, time.perf_counter() - batch_started)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,8 +9,8 @@ dir_name = '/Users/chstei/Postdoc/E. coli ribosome/h23'
 file_name = 'h23-top_pruned.out.txt'
 
 # Location for saving the downloaded images. Make sure this directory exists before starting the script
-# Default: '/Downloads
-target_name = dir_name + '/Downloads'
+# Default: None for dir_name + '/Downloads'
+target_name = None
 
 nt_seq = 'GGUGUAGCGGUGAAAUGCGUAGAGACC'
 # Download the first n secondary structure images. Don't go higher than a few thousand to avoid flooding the mcfold
@@ -18,8 +18,40 @@ nt_seq = 'GGUGUAGCGGUGAAAUGCGUAGAGACC'
 # Default: 1000
 download_folds = 10
 # File extension for figure
-# Default: 'pdf', TODO supports export to multiple formats at the same time with e.g. ['pdf', 'ps']
+# Default: 'pdf', TODO supports export to multiple formats at the same time with e.g. ['pdf', 'ps']. The local backend
+# already writes all formats, e.g. ['pdf', 'png']
 ext_figure = ['pdf']
+# Where to draw the images: 'mcfold' downloads them from the mcfold website, 'local' draws them on this machine with
+# matplotlib without any network access, which allows for many more structures
+# Default: 'mcfold'
+render_backend = 'mcfold'
+# Number of processes for the local backend
+# Default: 4
+render_workers = 4
+# Read only the first download_folds structures through the <trace file>_index sidecar instead of parsing the whole
+# text? The index is built on first use if the trace file was not written with one
+# Default: True
+use_cache = True
+# Keep every downloaded image in a content-addressed cache, keyed by sequence, structure, energy and format? Re-runs,
+# interrupted runs and overlapping traces (e.g. pruned and complete) of the same sequence only download missing images
+# Default: True
+use_image_cache = True
+# Location of the image cache, can be shared by several target folders
+# Default: None for dir_name + '/image_cache'
+image_cache_name = None
+# Number of structures fetched at the same time over one pooled connection session
+# Default: 4
+fetch_workers = 4
+# Minimum time in s between two requests to the mcfold website, shared by all workers
+# Default: 0.5
+request_interval = 0.5
+# Number of retries for a failed request, waiting retry_backoff * 2^n s before retry n + 1
+# Default: 3
+retries = 3
+retry_backoff = 1
+# Timeout in s for a single request
+# Default: 60
+request_timeout = 60
 # URL for generating the secondary structure figure. This should not need to be changed
 # Default: 'https://major.iric.ca/cgi-bin/2DRender/render.cgi'
 url = 'https://major.iric.ca/cgi-bin/2DRender/render.cgi'
@@ -27,38 +59,250 @@ url = 'https://major.iric.ca/cgi-bin/2DRender/render.cgi'
 # -------
 # Imports
 # -------
-import requests
-from bs4 import BeautifulSoup
-
-dotbracket_data = dir_name + '/' + file_name
-with open(dotbracket_data, 'r') as dotbracket_file:
-    raw_list = [[index,     # List with 1-indexed number [0] to match mcfold online interface convention,
-                 item[0],   # dot-bracket structure [1] and corresponding energy [2]
-                 item[1].rstrip()]
-                for index, item in enumerate((line.split(' ')
-                                              for line in dotbracket_file), start=1)]
-cut_list = raw_list[:download_folds]
-
-for current_structure in cut_list:
-    query = '?structure=>' + file_name.split('.')[0] + '_' + str(current_structure[0]) \
-            + '|' + nt_seq \
-            + '|' + current_structure[1] \
-            + '%20' + current_structure[2] \
-            + '&structno=' + str(current_structure[0])
-    submit = requests.get(url + query)
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from fold_cache import read_trace
+from fold_cli import apply_settings, restore_settings, settings_snapshot
+from fold_index import open_index
+import os
+import hashlib
+import json
+import shutil
+import sys
+import threading
+import time
+from urllib.parse import urljoin
+# requests and bs4 are only imported by the mcfold backend, matplotlib only by the local backend
+
+worker_figures = []     # Figure of a local rendering worker process, reused for every structure it draws
+
+
+# -------
+# Classes
+# -------
+class RateLimiter:
+    # Hands out request slots at least interval s apart, across all threads
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(slot - now)
+
+
+class ImageCache:
+    # Images are stored as <sha256 of the key>.<ext>, index.jsonl lists one key per line with its sequence, structure,
+    # energy and format. An image is only added to the index once it is completely written, so an interrupted run
+    # leaves no partial entries behind
+    def __init__(self, cache_name):
+        self.cache_name = cache_name
+        self.index_path = cache_name + '/index.jsonl'
+        self.lock = threading.Lock()
+        os.makedirs(cache_name, exist_ok=True)
+        self.index = {}
+        try:
+            with open(self.index_path, 'r') as index_file:
+                for line in index_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # Line cut off by an interrupted run
+                    self.index[entry['key']] = entry
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def make_key(current_nt_seq, dotbracket, energy_label, ext):
+        return hashlib.sha256('|'.join([current_nt_seq, dotbracket, energy_label, ext]).encode()).hexdigest()
+
+    def image_path(self, key):
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        image_path = self.cache_name + '/' + entry['file']
+        return image_path if os.path.isfile(image_path) else None
+
+    def add(self, key, content, **entry):
+        file = key + '.' + entry['ext']
+        temp_path = f'{self.cache_name}/{file}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as image_file:
+            image_file.write(content)
+        os.replace(temp_path, self.cache_name + '/' + file)
+        entry = dict(key=key, file=file, **entry)
+        with self.lock:
+            with open(self.index_path, 'a') as index_file:
+                index_file.write(json.dumps(entry) + '\n')
+            self.index[key] = entry
+        return self.cache_name + '/' + file
+
+
+# ---------
+# Functions
+# ---------
+def make_session(workers):
+    # One keep-alive connection per worker, reused for the render call and the download
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_with_retries(session, limiter, request_url):
+    import requests
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            response = session.get(request_url, timeout=request_timeout)
+            response.raise_for_status()
+            return response
+        except requests.RequestException:
+            if attempt == retries:
+                raise
+            time.sleep(retry_backoff * 2 ** attempt)
+
+
+def structure_query(current_structure, current_file_name, current_nt_seq):
+    return '?structure=>' + current_file_name.split('.')[0] + '_' + str(current_structure[0]) \
+           + '|' + current_nt_seq \
+           + '|' + current_structure[1] \
+           + '%20' + current_structure[2] \
+           + '&structno=' + str(current_structure[0])
+
+
+def cut_structures(current_dir_name, current_file_name):
+    trace_path = current_dir_name + '/' + current_file_name
+    trace = open_index(trace_path).read_rows(0, download_folds) if use_cache else read_trace(trace_path)
+    return [[index,                     # List with 1-indexed number [0] to match mcfold online interface convention,
+             dotbracket.decode(),       # dot-bracket structure [1] and corresponding energy [2]
+             energy_label.decode()]
+            for index, (dotbracket, energy_label) in enumerate(zip(trace['dotbrackets'][:download_folds],
+                                                                   trace['energy_labels'][:download_folds]), start=1)]
+
+
+def output_name(current_structure, ext, current_target_name):
+    return current_target_name \
+           + '/' + str(current_structure[0]) \
+           + '_' + current_structure[2] \
+           + '.' + ext
+
+
+def fetch_structure(session, limiter, current_structure, current_file_name, current_nt_seq, current_target_name,
+                    image_cache=None):
+    # Returns True if the image came from the cache
+    from bs4 import BeautifulSoup
+    output_file = output_name(current_structure, ext_figure[0], current_target_name)
+    if image_cache is not None:
+        key = ImageCache.make_key(current_nt_seq, current_structure[1], current_structure[2], ext_figure[0])
+        cached_path = image_cache.image_path(key)
+        if cached_path is not None:
+            shutil.copyfile(cached_path, output_file)
+            return True
+
+    submit = get_with_retries(session, limiter,
+                              url + structure_query(current_structure, current_file_name, current_nt_seq))
     result = BeautifulSoup(submit.text, features='html.parser')
     link = result.find('a', string=ext_figure[0].upper())
-    download = requests.get(link.attrs['href'])
-    output_file = target_name \
-                  + '/' + str(current_structure[0]) \
-                  + '_' + current_structure[2] \
-                  + '.' + ext_figure[0]
-    try:
+    if link is None:
+        raise ValueError(f'No {ext_figure[0].upper()} link on the render page')
+    download = get_with_retries(session, limiter, urljoin(submit.url, link.attrs['href']))
+    if image_cache is not None:
+        cached_path = image_cache.add(key, download.content, nt_seq=current_nt_seq, dotbracket=current_structure[1],
+                                      energy=current_structure[2], ext=ext_figure[0])
+        shutil.copyfile(cached_path, output_file)
+    else:
         with open(output_file, 'wb') as downloaded:
             downloaded.write(download.content)
-    except FileNotFoundError:
+    return False
+
+
+def fetch_structures(structures, current_file_name, current_nt_seq, current_target_name,
+                     current_image_cache_name=None):
+    # Returns a dict of 1-indexed structure number -> exception for the structures that could not be fetched. The
+    # image cache defaults to image_cache_name
+    import requests
+    failed = {}
+    cached = 0
+    limiter = RateLimiter(request_interval)
+    image_cache = ImageCache(current_image_cache_name or image_cache_name) if use_image_cache else None
+    with make_session(fetch_workers) as session, ThreadPoolExecutor(fetch_workers) as pool:
+        futures = {pool.submit(fetch_structure, session, limiter, current_structure, current_file_name, current_nt_seq,
+                               current_target_name, image_cache): current_structure[0]
+                   for current_structure in structures}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                cached += future.result()
+            except (requests.RequestException, ValueError, OSError) as error:
+                failed[futures[future]] = error
+                print(f'Failed structure {futures[future]}: {error}')
+            print('Downloaded ' + str(done - len(failed)) + '/' + str(len(structures)) + ' structures'
+                  + (f' ({cached} from the image cache)' if cached else ''))
+    return failed
+
+
+def render_local(current_structure, current_file_name, current_nt_seq, current_target_name):
+    from fold_render import render_structure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    if not worker_figures:
+        worker_figures.append(Figure())
+        FigureCanvasAgg(worker_figures[0])
+    title = current_file_name.split('.')[0] + '_' + str(current_structure[0]) + ' ' + current_structure[2]
+    for ext in ext_figure:
+        render_structure(output_name(current_structure, ext, current_target_name), current_nt_seq,
+                         current_structure[1], title, worker_figures[0])
+    return current_structure[0]
+
+
+def render_structures(structures, current_file_name, current_nt_seq, current_target_name):
+    # Same interface as fetch_structures for the local backend. Everything a worker needs is passed to it, so that it
+    # doesn't depend on the module globals of the main process
+    failed = {}
+    with ProcessPoolExecutor(render_workers, initializer=restore_settings,
+                             initargs=(settings_snapshot(globals()),)) as pool:
+        futures = {pool.submit(render_local, current_structure, current_file_name, current_nt_seq,
+                               current_target_name): current_structure[0]
+                   for current_structure in structures}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                future.result()
+            except (ValueError, OSError) as error:
+                failed[futures[future]] = error
+                print(f'Failed structure {futures[future]}: {error}')
+            print('Rendered ' + str(done - len(failed)) + '/' + str(len(structures)) + ' structures')
+    return failed
+
+
+def main(argv=None):
+    global target_name, image_cache_name
+    apply_settings(globals(), 'Fetch or draw secondary structure images of the structures in an mcff trace file', argv)
+    # Derived here rather than at the top, so that they follow a dir_name set on the command line
+    if target_name is None:
+        target_name = dir_name + '/Downloads'
+    if image_cache_name is None:
+        image_cache_name = dir_name + '/image_cache'
+    if not os.path.isdir(target_name):
         print('# ----------------------------------------------------' + '-' * len(target_name))
         print(f'# Please create the folder {target_name} before running this script')
         print('# ----------------------------------------------------' + '-' * len(target_name))
-        break
-    print('Downloaded ' + str(current_structure[0]) + '/' + str(cut_list[-1][0]) + ' structures')
+        sys.exit()
+
+    cut_list = cut_structures(dir_name, file_name)
+    if render_backend == 'local':
+        failed = render_structures(cut_list, file_name, nt_seq, target_name)
+    else:
+        failed = fetch_structures(cut_list, file_name, nt_seq, target_name)
+    if failed:
+        print('# ------------------------------------------------------------')
+        print(f'# {len(failed)} structures could not be fetched: {sorted(failed)}')
+        print('# ------------------------------------------------------------')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Local stand-in for the mcfold render.cgi: the render page links to a PDF and a PS download of the structure, like the
+# real one. Structures can be set up to answer with 503 a number of times or to have no download links, and every
+# request is recorded. Run it directly for manual tests of mcfold_fetch_images with
+# url = 'http://127.0.0.1:8765/cgi-bin/2DRender/render.cgi'
+import argparse
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # Keep-alive, as the pooled session expects
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path)
+        if path.path.endswith('render.cgi'):
+            structno = int(parse_qs(path.query)['structno'][0])
+        else:
+            structno = int(path.path.rsplit('/', 1)[1].split('.')[0])
+        with server.lock:
+            server.requests.append((path.path, structno))
+            failing = server.failures.get(structno, 0) > 0 or random.random() < server.failure_rate
+            if server.failures.get(structno, 0) > 0:
+                server.failures[structno] -= 1
+        if failing:
+            return self.send(503, b'Service busy', 'text/plain')
+        if path.path.endswith('render.cgi'):
+            links = '' if structno in server.no_link \
+                else f'<a href="/img/{structno}.pdf">PDF</a> <a href="/img/{structno}.ps">PS</a>'
+            return self.send(200, f'<html><body>{links}</body></html>'.encode(), 'text/html')
+        return self.send(200, f'%PDF stand-in {structno}'.encode(), 'application/pdf')
+
+
+class MCFoldStandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, failure_rate=0.0):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.lock = threading.Lock()
+        self.failures = {}      # Structure number -> number of 503 answers before it succeeds
+        self.no_link = set()    # Structure numbers whose render page has no download links
+        self.failure_rate = failure_rate
+        self.requests = []      # (path, structure number) of every request
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/cgi-bin/2DRender/render.cgi'
+
+    def render_requests(self, structno):
+        return sum(1 for path, number in self.requests if number == structno and path.endswith('render.cgi'))
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the mcfold render.cgi')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--failure-rate', type=float, default=0.2, help='share of requests answered with 503')
+    arguments = parser.parse_args()
+    MCFoldStandIn(arguments.port, arguments.failure_rate).serve_forever()
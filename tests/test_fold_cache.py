@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from fold_cache import read_trace, text_columns, TraceCache
+
+
+@pytest.fixture
+def trace_path(tmp_path):
+    path = tmp_path / 'h23_complete.out.txt'
+    path.write_text('((((...)))) -10.00\n(((.....))) -8.50\n')
+    TraceCache(str(path)).save(**read_trace(str(path)))
+    return str(path)
+
+
+def test_load_without_hashing(trace_path, monkeypatch):
+    # An unchanged trace file is recognized by its size and modification time alone
+    monkeypatch.setattr(TraceCache, 'content_hash', lambda self: pytest.fail('trace file was hashed'))
+    columns = TraceCache(trace_path).load(*text_columns)
+    assert columns['energies'].tolist() == [-10.0, -8.5]
+
+
+def test_touched_file_keeps_cache(trace_path, monkeypatch):
+    stat = os.stat(trace_path)
+    os.utime(trace_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert TraceCache(trace_path).load(*text_columns) is not None
+    # The new stamp is stored, so the next load takes the fast path again
+    monkeypatch.setattr(TraceCache, 'content_hash', lambda self: pytest.fail('trace file was hashed'))
+    assert TraceCache(trace_path).load(*text_columns) is not None
+
+
+def test_changed_file_invalidates_cache(trace_path):
+    stat = os.stat(trace_path)
+    with open(trace_path, 'w') as trace_file:
+        trace_file.write('((((...)))) -10.00\n(((.....))) -8.60\n')    # Same size
+    os.utime(trace_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert TraceCache(trace_path).load(*text_columns) is None
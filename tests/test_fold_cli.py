@@ -0,0 +1,49 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import fold_prune
+import mcfold_fetch_images
+from fold_cli import apply_settings, restore_settings, settings_snapshot
+
+
+def prune_settings():
+    return fold_prune.workers, fold_prune.profile_report, fold_prune.use_cache
+
+
+def test_apply_settings():
+    settings = {'__name__': 'script', 'workers': 1, 'file_names': [], 'label': 'a'}
+    apply_settings(settings, 'test', ['--set', 'workers=4', '-s', "file_names=['a.txt']", '-s', 'label=plain text'])
+    assert settings['workers'] == 4
+    assert settings['file_names'] == ['a.txt']
+    assert settings['label'] == 'plain text'
+
+
+@pytest.mark.parametrize('setting', ['unknown=1', 'workers', '_private=1', 'apply_settings=1'])
+def test_rejects_unknown_settings(setting):
+    with pytest.raises(SystemExit):
+        apply_settings({'__name__': 'script', 'workers': 1, '_private': 1, 'apply_settings': apply_settings}, 'test',
+                       ['--set', setting])
+
+
+def test_workers_get_the_settings_with_spawn(monkeypatch):
+    # Spawned workers import fold_prune afresh, restore_settings gives them the settings of the main process
+    monkeypatch.setattr(fold_prune, 'workers', 2)
+    monkeypatch.setattr(fold_prune, 'profile_report', ['csv'])
+    monkeypatch.setattr(fold_prune, 'use_cache', False)
+    snapshot = settings_snapshot(vars(fold_prune))
+    assert 'TraceFile' not in snapshot['fold_prune']
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'), initializer=restore_settings,
+                             initargs=(snapshot,)) as pool:
+        assert pool.submit(prune_settings).result() == (2, ['csv'], False)
+
+
+def test_derived_settings_follow_overrides(monkeypatch, tmp_path, capsys):
+    # target_name and image_cache_name are derived from dir_name after the overrides, not at import time
+    for name in ['dir_name', 'target_name', 'image_cache_name']:
+        monkeypatch.setattr(mcfold_fetch_images, name, getattr(mcfold_fetch_images, name))
+    with pytest.raises(SystemExit):
+        mcfold_fetch_images.main(['--set', f'dir_name={tmp_path}'])
+    assert f'Please create the folder {tmp_path}/Downloads' in capsys.readouterr().out
+    assert mcfold_fetch_images.image_cache_name == f'{tmp_path}/image_cache'
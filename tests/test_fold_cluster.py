@@ -0,0 +1,53 @@
+import random
+
+import numpy as np
+import pytest
+
+from fold_cluster import cluster_structures, pair_sets
+from fold_parse import dotbracket_to_pair_table
+from fold_synthetic import breathing_variant, random_dotbracket
+
+
+def pair_tables(dotbrackets):
+    return np.array([dotbracket_to_pair_table(dotbracket) for dotbracket in dotbrackets], dtype=np.int16)
+
+
+def greedy_clusters(tables, k):
+    # Reference: every structure is compared to all representatives found so far
+    representatives, distances, found = [], [], []
+    for row, pairs in enumerate(pair_sets(tables)):
+        match = next(((index, len(pairs ^ other)) for index, other in found if len(pairs ^ other) <= k), None)
+        if match is None:
+            found.append((row, pairs))
+            match = (row, 0)
+        representatives.append(match[0])
+        distances.append(match[1])
+    return representatives, distances
+
+
+def random_structures(count, stem_rate, seed):
+    rng = random.Random(seed)
+    dotbrackets = [random_dotbracket(60, rng, stem_rate) for _ in range(count)]
+    dotbrackets += [variant for variant in (breathing_variant(dotbracket, rng) for dotbracket in dotbrackets) if variant]
+    rng.shuffle(dotbrackets)
+    return pair_tables(dotbrackets)
+
+
+@pytest.mark.parametrize('stem_rate', [0.15, 0.02])
+@pytest.mark.parametrize('k', [1, 3, 6])
+@pytest.mark.parametrize('method', ['sketch', 'bktree'])
+def test_matches_greedy_clustering(method, k, stem_rate):
+    tables = random_structures(300, stem_rate, seed=k)
+    representatives, distances, _ = cluster_structures(tables, k, method)
+    assert (representatives.tolist(), distances.tolist()) == greedy_clusters(tables, k)
+
+
+def test_sparse_structures_are_not_compared_to_every_representative():
+    # Structures with fewer pairs than buckets used to share their empty buckets with every other representative
+    k = 4
+    dotbrackets = ['.' * nt + '((((....))))' + '.' * (48 - nt) for nt in range(48)] + ['.' * 60]
+    tables = pair_tables(dotbrackets)
+    representatives, distances, metric_index = cluster_structures(tables, k, 'sketch')
+    assert (representatives.tolist(), distances.tolist()) == greedy_clusters(tables, k)
+    assert metric_index.size == len(dotbrackets) - 1    # The open structure joins the first stem
+    assert metric_index.comparisons < len(dotbrackets)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from fold_frequency import FrequencyIndex, sparse_convergence
+from fold_parse import dotbracket_to_pair_table
+from fold_synthetic import make_trace, write_trace
+import fold_dotplot
+
+size = 80
+
+
+@pytest.fixture(scope='module')
+def pair_tables():
+    trace = make_trace(size, 2000, seed=2)
+    return np.array([dotbracket_to_pair_table(dotbracket) for dotbracket, _ in trace], dtype=np.int16)
+
+
+@pytest.fixture(scope='module')
+def frequency_index(pair_tables):
+    return FrequencyIndex(pair_tables, np.linspace(-20, -15, len(pair_tables)), size)
+
+
+def test_convergence_matches_single_cutoffs(frequency_index):
+    # Cutoffs come out sorted and once each, cutoffs above the number of structures are clipped to it
+    series = list(frequency_index.convergence([100, 1, 5000, 0, 100, 7]))
+    assert [folds for folds, _, _ in series] == [0, 1, 7, 100, 2000]
+    for folds, current_freq, current_unpaired in series:
+        assert np.array_equal(current_freq, frequency_index.frequency_matrix(folds))
+        assert np.array_equal(current_unpaired, frequency_index.unpaired_counts(folds))
+
+
+def test_sparse_convergence_matches_dense(pair_tables, frequency_index):
+    pytest.importorskip('scipy')
+    cutoffs = [100, 1, 5000, 0, 100, 7, 1500]
+    chunks = (pair_tables[start:start + 300] for start in range(0, len(pair_tables), 300))  # Cutoffs split chunks
+    sparse_series = list(sparse_convergence(chunks, size, cutoffs))
+    dense_series = list(frequency_index.convergence(cutoffs))
+    assert [folds for folds, _, _ in sparse_series] == [folds for folds, _, _ in dense_series]
+    for (_, sparse_freq, sparse_unpaired), (_, dense_freq, dense_unpaired) in zip(sparse_series, dense_series):
+        assert np.array_equal(sparse_freq.toarray(), dense_freq)
+        assert np.array_equal(sparse_unpaired, dense_unpaired)
+
+
+def test_convergence_cutoffs(tmp_path, monkeypatch):
+    write_trace(str(tmp_path / 'h23_pruned.out.txt'), size, 50, seed=3)
+    monkeypatch.setattr(fold_dotplot, 'use_cache', False)
+    monkeypatch.setattr(fold_dotplot, 'convergence_folds', [10, 1000])
+    fold_dotplot.compute_plot_data(str(tmp_path), 'h23_pruned.out.txt', 'A' * size)
+    with open(tmp_path / 'h23_pruned.out.txt_convergence.csv', 'r') as convergence_file:
+        assert [line.split(',')[0] for line in convergence_file.read().splitlines()] == ['folds', '10', '50']
+    monkeypatch.setattr(fold_dotplot, 'convergence_folds', [0, -10])
+    with pytest.raises(ValueError, match='selects any of the 50 structures'):
+        fold_dotplot.compute_plot_data(str(tmp_path), 'h23_pruned.out.txt', 'A' * size)
@@ -0,0 +1,33 @@
+import pytest
+
+from fold_index import IndexWriter, open_index
+
+
+def test_offsets_in_bytes(tmp_path):
+    # Lines are counted in bytes as written, also for non-ASCII text and without translated line breaks
+    trace_path = str(tmp_path / 'h23_complete.out.txt')
+    lines = ['((((...)))) -10.00\n', '(((.....))) -8.50 é\n', '........... 0.00\n']
+    index_writer = IndexWriter(trace_path)
+    with open(trace_path, 'w', encoding='utf-8', newline='\n') as trace_file:
+        for line in lines:
+            trace_file.write(line)
+            index_writer.add(line)
+    index_writer.save()
+    trace_index = open_index(trace_path)
+    assert trace_index.read_bytes(2, 3) == b'........... 0.00\n'
+    assert trace_index.energies.tolist() == [-10.0, -8.5, 0.0]
+
+
+def test_blank_lines(tmp_path):
+    trace_path = tmp_path / 'h23_complete.out.txt'
+    trace_path.write_bytes(b'\n((((...)))) -10.00\n\n(((.....))) -8.50\n\n')
+    trace_index = open_index(str(trace_path))
+    assert len(trace_index) == 2
+    assert trace_index.read_rows(0, 2)['energies'].tolist() == [-10.0, -8.5]
+    assert trace_index.read_rows(1, 2)['dotbrackets'].tolist() == [b'(((.....)))']
+
+
+@pytest.mark.parametrize('line', ['structures: 10\n', 'malformed\n'])
+def test_rejects_lines_without_an_energy(tmp_path, line):
+    with pytest.raises(ValueError, match='Line without a structure and an energy'):
+        IndexWriter(str(tmp_path / 'h23_complete.out.txt')).add(line)
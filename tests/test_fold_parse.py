@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from fold_parse import dotbracket_to_pair_table, has_single_bp_stem, parse_dotbracket
+from fold_synthetic import bridge_variant, random_dotbracket
+
+fgb = pytest.importorskip('forgi.graph.bulge_graph')
+
+
+def forgi_parse(dotbracket):
+    bulge_graph = fgb.BulgeGraph.from_dotbracket(dotbracket)
+    return list(bulge_graph.to_pair_table()[1:]), bulge_graph.length_one_stem_basepairs() != []
+
+
+@pytest.mark.parametrize('dotbracket', [
+    '.....',                    # Unpaired only
+    '(...)',                    # Single-bp stem as the whole structure
+    '((...))..(...)',           # Single-bp stem next to a regular stem
+    '((.((...))))',             # Bulged single pair closing a stem
+    '(((.(...).)))',            # Single pair between two interior loops
+    '((((...)).))',             # Bulge on one side only
+    '((..[[..))..]]',           # Pseudoknot brackets
+    '((..[..))..]',             # Single-bp pseudoknot
+    '((<<..))..>>..{{..}}',     # All bracket types
+])
+def test_matches_forgi(dotbracket):
+    assert parse_dotbracket(dotbracket) == forgi_parse(dotbracket)
+
+
+def test_matches_forgi_on_random_structures():
+    rng = random.Random(0)
+    for _ in range(300):
+        dotbracket = random_dotbracket(rng.randint(10, 120), rng)
+        bridged = bridge_variant(dotbracket, rng)
+        for current in [dotbracket] if bridged is None else [dotbracket, bridged]:
+            assert parse_dotbracket(current) == forgi_parse(current), current
+
+
+def test_single_bp_stem_flag():
+    assert has_single_bp_stem(dotbracket_to_pair_table('((.(...)))'))
+    assert not has_single_bp_stem(dotbracket_to_pair_table('((...))'))
+
+
+@pytest.mark.parametrize('dotbracket', ['((...)', '(...))', '(..x..)', '([)'])
+def test_rejects_malformed(dotbracket):
+    with pytest.raises(ValueError):
+        dotbracket_to_pair_table(dotbracket)
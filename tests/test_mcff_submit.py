@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import mcff_submit
+
+stub_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+sequence = 'GGGGAAACCCC'
+
+
+@pytest.fixture
+def settings(monkeypatch, tmp_path):
+    # The stub mcff in tests/bin comes first on the PATH
+    monkeypatch.setenv('PATH', stub_dir + os.pathsep + os.environ['PATH'])
+    for name, value in {'predict_folds': 5, 'energy_cutoff': None, 'mcff_workers': 2, 'mcff_timeout': 10,
+                        'streaming': True, 'stream_prune': False, 'use_result_store': False,
+                        'result_store_name': str(tmp_path / 'store')}.items():
+        monkeypatch.setattr(mcff_submit, name, value)
+    return tmp_path
+
+
+def read_lines(path):
+    with open(path, 'r') as trace_file:
+        return trace_file.read().splitlines()
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_strips_header_lines(settings, monkeypatch, streaming):
+    monkeypatch.setattr(mcff_submit, 'streaming', streaming)
+    mcff_submit.stored_job(None, str(settings), 'wt_complete.out.txt', sequence)
+    lines = read_lines(settings / 'wt_complete.out.txt')
+    assert len(lines) == 5
+    assert lines[0] == '((((...)))) -10.00'
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_keeps_all_lines_for_energy_cutoff(settings, monkeypatch, streaming):
+    monkeypatch.setattr(mcff_submit, 'streaming', streaming)
+    monkeypatch.setattr(mcff_submit, 'predict_folds', None)
+    monkeypatch.setattr(mcff_submit, 'energy_cutoff', 0.35)
+    mcff_submit.stored_job(None, str(settings), 'wt_complete.out.txt', sequence)
+    assert read_lines(settings / 'wt_complete.out.txt')[0] == '((((...)))) -10.00'
+    assert len(read_lines(settings / 'wt_complete.out.txt')) == 4
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_non_zero_exit(settings, monkeypatch, streaming):
+    monkeypatch.setattr(mcff_submit, 'streaming', streaming)
+    [(output_name, (status, runtime, message))] = mcff_submit.run_jobs([(str(settings), 'x_complete.out.txt',
+                                                                        'GGGXAAACCC')])
+    assert status == 'failed'
+    assert message.startswith('mcff exit status 3: Unknown nucleotide X')
+    assert not os.path.exists(output_name)
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_timeout(settings, monkeypatch, streaming):
+    monkeypatch.setattr(mcff_submit, 'streaming', streaming)
+    monkeypatch.setattr(mcff_submit, 'mcff_timeout', 0.5)
+    [(output_name, (status, runtime, message))] = mcff_submit.run_jobs([(str(settings), 'z_complete.out.txt',
+                                                                        'GGGZAAACCC')])
+    assert status == 'timeout'
+    assert not os.path.exists(output_name)
+
+
+def test_partial_failure(settings):
+    # Failing jobs don't affect the others, and jobs with the same file name in different folders are kept apart
+    for folder in ['wt', 'mutant']:
+        os.mkdir(settings / folder)
+    jobs = [(str(settings / 'wt'), 'h23_complete.out.txt', sequence),
+            (str(settings / 'mutant'), 'h23_complete.out.txt', 'GGGGAAACCCU'),
+            (str(settings / 'missing'), 'h23_complete.out.txt', sequence),
+            (str(settings / 'wt'), 'bad_complete.out.txt', 'GGGXAAACCC')]
+    results = mcff_submit.run_jobs(jobs)
+    assert [output_name for output_name, _ in results] == [job[0] + '/' + job[1] for job in jobs]
+    assert [status for _, (status, _, _) in results] == ['done', 'done', 'failed', 'failed']
+    assert 'please create the folder' in results[2][1][2]
+    assert len(read_lines(settings / 'mutant' / 'h23_complete.out.txt')) == 5
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_mcff_not_found(settings, monkeypatch, streaming):
+    monkeypatch.setenv('PATH', str(settings))
+    monkeypatch.setattr(mcff_submit, 'streaming', streaming)
+    [(output_name, (status, runtime, message))] = mcff_submit.run_jobs([(str(settings), 'wt_complete.out.txt',
+                                                                        sequence)])
+    assert status == 'failed'
+    assert 'mcff was not found' in message
+    assert not os.path.exists(output_name)
+
+
+@pytest.mark.parametrize('stream_prune', [False, True])
+def test_malformed_output(settings, monkeypatch, stream_prune):
+    # Neither the _complete nor the _pruned file of a run with unreadable output is left behind
+    monkeypatch.setattr(mcff_submit, 'stream_prune', stream_prune)
+    [(output_name, (status, runtime, message))] = mcff_submit.run_jobs([(str(settings), 'm_complete.out.txt',
+                                                                        'GGGGMAACCCC')])
+    assert status == 'failed'
+    assert 'Line without a structure and an energy' in message
+    assert os.listdir(settings) == []
+
+
+def stored_job_in_process(store_name, output_dir, number):
+    # Runs in a separate process with its own ResultStore, like a fold_pipeline worker
+    os.environ['PATH'] = stub_dir + os.pathsep + os.environ['PATH']
+    mcff_submit.predict_folds = 5
+    store = mcff_submit.ResultStore(store_name, 10**9)
+    return mcff_submit.stored_job(store, output_dir, f'{number}_complete.out.txt', sequence + 'A' * number)[0]
+
+
+def test_result_store_shared_by_processes(settings):
+    store_name = str(settings / 'store')
+    jobs = range(8)
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context('spawn')) as pool:
+        assert list(pool.map(stored_job_in_process, [store_name] * 8, [str(settings)] * 8, jobs)) == ['done'] * 8
+        assert list(pool.map(stored_job_in_process, [store_name] * 8, [str(settings)] * 8, jobs)) == ['stored'] * 8
+    stored = [name for name in os.listdir(store_name) if name.endswith('.out.txt')]
+    assert len(mcff_submit.ResultStore(store_name, 10**9).read_index()) == len(stored) == 8
+
+
+def test_result_store_serves_top_structures(settings, monkeypatch):
+    monkeypatch.setattr(mcff_submit, 'predict_folds', 8)
+    store = mcff_submit.ResultStore(str(settings / 'store'), 10**9)
+    assert mcff_submit.stored_job(store, str(settings), 'all_complete.out.txt', sequence)[0] == 'done'
+    monkeypatch.setattr(mcff_submit, 'predict_folds', 3)
+    assert mcff_submit.stored_job(store, str(settings), 'top_complete.out.txt', sequence)[0] == 'stored'
+    assert read_lines(settings / 'top_complete.out.txt') == read_lines(settings / 'all_complete.out.txt')[:3]
+    # Energy cutoffs are only served from a run with the same cutoff
+    monkeypatch.setattr(mcff_submit, 'predict_folds', None)
+    monkeypatch.setattr(mcff_submit, 'energy_cutoff', 0.5)
+    assert mcff_submit.stored_job(store, str(settings), 'wide_complete.out.txt', sequence)[0] == 'done'
+    monkeypatch.setattr(mcff_submit, 'energy_cutoff', 0.2)
+    assert mcff_submit.stored_job(store, str(settings), 'narrow_complete.out.txt', sequence)[0] == 'done'
+
+
+def test_summary_without_jobs(settings, capsys):
+    mcff_submit.print_summary(mcff_submit.run_jobs([]), 0.0)
+    assert '0/0 jobs done' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_skips_blank_lines(settings, monkeypatch, streaming):
+    monkeypatch.setattr(mcff_submit, 'streaming', streaming)
+    assert mcff_submit.stored_job(None, str(settings), 'b_complete.out.txt', 'GGGGBAACCCC')[0] == 'done'
+    lines = read_lines(settings / 'b_complete.out.txt')
+    assert len(lines) == 5 and all(lines)
+    trace_index = mcff_submit.open_index(str(settings / 'b_complete.out.txt'))
+    assert trace_index.read_rows(0, 5)['dotbrackets'].astype(str).tolist() == [line.split()[0] for line in lines]
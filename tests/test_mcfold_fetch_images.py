@@ -0,0 +1,97 @@
+import types
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+
+import mcfold_fetch_images
+from mcfold_stand_in import MCFoldStandIn
+
+structures = [[1, '((((...))))', '-5.10'],
+              [2, '(((.....)))', '-4.20'],
+              [3, '.((.....)).', '-3.00'],
+              [4, '...........', '0.00']]
+
+
+@pytest.fixture
+def stand_in():
+    server = MCFoldStandIn().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Waiting times of the retries, recorded instead of slept
+    recorded = []
+    fake_time = types.SimpleNamespace(monotonic=mcfold_fetch_images.time.monotonic,
+                                      sleep=lambda seconds: recorded.append(seconds) if seconds > 0 else None)
+    monkeypatch.setattr(mcfold_fetch_images, 'time', fake_time)
+    return recorded
+
+
+@pytest.fixture
+def settings(monkeypatch, tmp_path, stand_in):
+    for name, value in {'url': stand_in.url, 'ext_figure': ['pdf'], 'fetch_workers': 2, 'request_interval': 0,
+                        'retries': 3, 'retry_backoff': 1, 'request_timeout': 10, 'use_image_cache': False,
+                        'image_cache_name': str(tmp_path / 'image_cache')}.items():
+        monkeypatch.setattr(mcfold_fetch_images, name, value)
+    return tmp_path
+
+
+def fetch(current_structures, target):
+    return mcfold_fetch_images.fetch_structures(current_structures, 'test_pruned.out.txt', 'GGGGAAACCCC', str(target))
+
+
+def test_fetches_all_structures(settings, stand_in, sleeps):
+    assert fetch(structures, settings) == {}
+    for current_structure in structures:
+        with open(mcfold_fetch_images.output_name(current_structure, 'pdf', str(settings)), 'rb') as image_file:
+            assert image_file.read() == f'%PDF stand-in {current_structure[0]}'.encode()
+    assert sleeps == []
+
+
+def test_retries_with_backoff(settings, stand_in, sleeps):
+    stand_in.failures[1] = 2
+    assert fetch(structures[:1], settings) == {}
+    assert stand_in.render_requests(1) == 3
+    assert sleeps == [1, 2]
+
+
+def test_gives_up_after_retries(settings, stand_in, sleeps, monkeypatch):
+    monkeypatch.setattr(mcfold_fetch_images, 'retries', 2)
+    stand_in.failures[1] = 10
+    failed = fetch(structures[:1], settings)
+    assert list(failed) == [1]
+    assert '503' in str(failed[1])
+    assert stand_in.render_requests(1) == 3
+    assert sleeps == [1, 2]
+
+
+def test_missing_link(settings, stand_in, sleeps):
+    stand_in.no_link.add(1)
+    failed = fetch(structures[:1], settings)
+    assert isinstance(failed[1], ValueError)
+    assert 'No PDF link' in str(failed[1])
+
+
+def test_partial_failure(settings, stand_in, sleeps):
+    # A failing structure doesn't stop the others
+    stand_in.no_link.add(2)
+    stand_in.failures[4] = 10
+    failed = fetch(structures, settings)
+    assert sorted(failed) == [2, 4]
+    assert sorted(path.name for path in settings.glob('*.pdf')) == ['1_-5.10.pdf', '3_-3.00.pdf']
+
+
+def test_image_cache(settings, stand_in, sleeps, monkeypatch):
+    monkeypatch.setattr(mcfold_fetch_images, 'use_image_cache', True)
+    assert fetch(structures, settings) == {}
+    requests_made = len(stand_in.requests)
+    for image in settings.glob('*.pdf'):
+        image.unlink()
+    assert fetch(structures, settings) == {}
+    assert len(stand_in.requests) == requests_made
+    assert len(list(settings.glob('*.pdf'))) == len(structures)